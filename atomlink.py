@@ -1,19 +1,25 @@
+import io
 import json
 import argparse
+from contextlib import redirect_stdout
+from multiprocessing import Pool
 
 from lambekseq.lbnoprod import LambekProof
 from lambekseq.displace import DisplaceProof
-from lambekseq.cmll import ProofNet
-from lambekseq.cntccg import Cntccg
+from lambekseq.cmll import ProofNet, MergedProofNet
+from lambekseq.cntccg import Cntccg, WeightCost, unslashCost
 
+from lambekseq.lib.cache import LockedCache, makeCache
 from lambekseq.lib.cindex import indexSeq
+from lambekseq.lib.store import ProofStore
 from lambekseq.lib.cterm import bipart, isatomic
 
 
 CALC_DICT = dict(ccg=Cntccg,
                  dsp=DisplaceProof,
                  lb=LambekProof,
-                 pn=ProofNet)
+                 pn=ProofNet,
+                 pt=MergedProofNet)
 
 
 def deAbbr(con: str, pres: list, abbr: dict, 
@@ -59,22 +65,55 @@ def deAbbr(con: str, pres: list, abbr: dict,
             yield con, pres
 
 
-def searchLinks(cls, con, pres, **kwargs):
+def searchLinks(cls, con, pres, limit=None, store=None, countOnly=False,
+                **kwargs):
     '''Return the indexed `con`, `pres`,
     the run parser and the index dictionary `idxDic`.
     `idxDic.toToken` maps indices to token numbers.
     `idxDic.toDepth` maps indices to atom depths.
+    Lambek/Displacement calculus stop after `limit` proofs if given,
+    unless in the `trace` mode.
+    If a `lib.store.ProofStore` is given, proofs are looked up there first
+    and recorded there after parsing. No proof tree can be built then.
+    If `countOnly`, proofs are counted but not built (see `countProofs`),
+    `parser.count` is their number, and `parser.countMethod` tells if
+    they were 'tabulated' or, at the cost of a search, 'enumerated'.
     '''
     (con, *pres), idxDic = indexSeq(con, pres)   
-    if cls == ProofNet:
+    if issubclass(cls, ProofNet):
         parser = cls.fromLambekSeq(con, pres, **kwargs)
     else:
         parser = cls(con, pres, **kwargs)
+
+    if countOnly:
+        parser.countProofs()
+        return con, pres, parser, idxDic
+
+    if (store is None or limit is not None 
+                      or getattr(parser, 'traceMode', 'none') != 'none'):
+        store = None
+    else:
+        proofs = store.get(cls, parser.storeOptions, con, pres)
+        if proofs is not None:
+            parser.loadProofs(proofs)
+            return con, pres, parser, idxDic
     
-    parser.parse()
+    if limit is None:
+        parser.parse()
+    else:
+        parser.parse(limit=limit)
+
+    if store is not None:
+        store.put(cls, parser.storeOptions, con, pres, parser.dumpProofs())
     return con, pres, parser, idxDic
 
 
+def isProvable(cls, con, pres, **kwargs):
+    '''Decide if `pres -> con` is derivable in `cls`, 
+    stopping at the first proof without collecting atom links.'''
+    return cls.isProvable(con, pres, **kwargs)
+
+
 def printLinks(con, pres, parser):
     if parser.proofCount:
         print('%s\n%s <= %s\n' % ('-' * 10, con, ' '.join(pres)))
@@ -82,6 +121,14 @@ def printLinks(con, pres, parser):
         print('Total: %d\n' % parser.proofCount)
 
 
+def printCount(con, pres, parser):
+    if parser.count:
+        print('%s\n%s <= %s\n' % ('-' * 10, con, ' '.join(pres)))
+        note = (' (enumerated)' if parser.countMethod == 'enumerated' 
+                else '')
+        print('Total: %d%s\n' % (parser.count, note))
+
+
 def printTree(con, pres, parser):
     if parser.proofCount:
         print('%s\n%s <= %s\n' % ('-' * 10, con, ' '.join(pres)))
@@ -113,7 +160,9 @@ def initArgParser():
              '"ccg" for continuized CCG; '
              '"dsp" for Displacement calculus; '
              '"lb" for classic Lambek calculus; '
-             '"pn" for Proofnet based Lambek calculus.'
+             '"pn" for Proofnet based Lambek calculus; '
+             '"pt" for a Proofnet recognizer of '
+             'Lambek calculus, which finds one proof at most.'
     )
     ap.add_argument('-t', '--traceMode',
         default='none',
@@ -148,32 +197,260 @@ def initArgParser():
         action='store_true',
         help='Used by Lambek/Displacement calculus/continuized CCG.'
     )
+    ap.add_argument('--decide',
+        default=False,
+        action='store_true',
+        help='Only tell if each input sequent is provable.'
+    )
+    ap.add_argument('--countOnly',
+        default=False,
+        action='store_true',
+        help='Only count the proofs of each input sequent, '
+             'without building them. '
+             'Not supported by continuized CCG.'
+    )
+    ap.add_argument('--limit',
+        default=None,
+        type=int,
+        help='[default] no limit. '
+             'Stop after this many proofs of a sequent. '
+             'Not used with --showTree, --countOnly or the trace mode. '
+             'Used by Lambek/Displacement calculus.'
+    )
+    ap.add_argument('--cacheSize',
+        default=None,
+        type=int,
+        help='[default] unbounded. '
+             'Maximum number of memoized subgoals or category pairs. '
+             'Used by Lambek/Displacement calculus and continuized CCG.'
+    )
+    ap.add_argument('--cachePolicy',
+        default='lru',
+        choices=['lru', 'cost'],
+        help='[default] "lru". '
+             'Eviction policy of a bounded memo table. '
+             '"cost" evicts the cheapest subgoals to recompute. '
+             'Used by Lambek/Displacement calculus and continuized CCG.'
+    )
+    ap.add_argument('-j', '--jobs',
+        default=1,
+        type=int,
+        help='[default] 1. '
+             'Number of worker processes. '
+             'Output keeps the input order.'
+    )
+    ap.add_argument('-w', '--workers',
+        default=None,
+        type=int,
+        help='[default] none. '
+             'Number of worker processes filling the chart of a sequent, '
+             'for long sequents. Not used with --jobs. '
+             'Used by continuized CCG/Proofnet based Lambek calculus.'
+    )
+    ap.add_argument('--cellCap',
+        default=None,
+        type=int,
+        help='[default] no limit. '
+             'Keep at most this many categories in a chart cell, '
+             'the cheapest by --scorer. Proofs may be lost. '
+             'Used by continuized CCG.'
+    )
+    ap.add_argument('--beam',
+        default=None,
+        type=float,
+        help='[default] no beam. '
+             'Keep the categories of a chart cell within this much '
+             'of the cheapest by --scorer. Proofs may be lost. '
+             'Used by continuized CCG.'
+    )
+    ap.add_argument('--scorer',
+        default=None,
+        help='[default] the length of the unslashed category. '
+             'A json file that contains a dictionary from '
+             'categories without indices to their costs, '
+             'for --cellCap and --beam. Other categories cost 0. '
+             'Used by continuized CCG.'
+    )
+    ap.add_argument('--chunkSize',
+        default=1,
+        type=int,
+        help='[default] 1. '
+             'Number of sequents sent to a worker at a time '
+             'when --jobs is more than 1.'
+    )
+    ap.add_argument('--store',
+        default=None,
+        help='[default] none. '
+             'A SQLite file where proofs are kept across runs. '
+             'Sequents found there are not proved again. '
+             'Not used with --showTree, --limit or a trace mode.'
+    )
+    ap.add_argument('--chartGC',
+        default=False,
+        action='store_true',
+        help='Drop chart cells once no longer needed. '
+             'Used by Proofnet based Lambek calculus.'
+    )
+    ap.add_argument('--chartStats',
+        default=False,
+        action='store_true',
+        help='Print the peak chart size after each sequent. '
+             'Used by Proofnet based Lambek calculus.'
+    )
+    ap.add_argument('--cacheStats',
+        default=False,
+        action='store_true',
+        help='Print memo table statistics after each sequent. '
+             'Used by Lambek/Displacement calculus and continuized CCG.'
+    )
     return ap
 
 
+def runSequent(calc, con, pres, args, limit=None, store=None):
+    '''Search and print the links of one expanded sequent.
+    Return the number of proofs found.'''
+    con, pres, parser, _ = searchLinks(calc, con, pres, 
+                                    limit=limit,
+                                    store=None if args.showTree else store,
+                                    countOnly=args.countOnly,
+                                    earlyCollapse=args.earlyCollapse,
+                                    islandFirst=args.islandFirst,
+                                    rruleFirst=args.rruleFirst,
+                                    gapLimit=args.gapLimit,
+                                    traceMode=args.traceMode,
+                                    cacheSize=args.cacheSize,
+                                    cachePolicy=args.cachePolicy,
+                                    chartGC=args.chartGC,
+                                    chartStats=args.chartStats,
+                                    cellCap=args.cellCap,
+                                    beam=args.beam,
+                                    scorer=args.scorer,
+                                    pairTable=args.pairTable,
+                                    workers=args.workers)
+    if args.countOnly:
+        printCount(con, pres, parser)
+    elif args.showTree and not issubclass(calc, ProofNet):
+        printTree(con, pres, parser)
+    else:
+        printLinks(con, pres, parser)
+    if args.cacheStats and hasattr(parser, 'cacheStats'):
+        print('Cache: %s\n' % parser.cacheStats)
+    if args.chartStats and getattr(parser, 'chartStats', None) is not None:
+        print('Chart: %s\n' % parser.chartStats)
+    if ((args.cellCap is not None or args.beam is not None) 
+            and getattr(parser, 'pruneStats', None) is not None):
+        print('Prune: %s\n' % parser.pruneStats)
+    return parser.count if args.countOnly else parser.proofCount
+
+
+def runLine(line, calc, abbr, args, store=None):
+    '''Print the result of every expansion of an input line.'''
+    con, *pres = line.split()
+    if args.decide:
+        print(line, '=>', any(isProvable(calc, con, pres,
+                                earlyCollapse=args.earlyCollapse,
+                                islandFirst=args.islandFirst,
+                                rruleFirst=args.rruleFirst,
+                                gapLimit=args.gapLimit,
+                                cellCap=args.cellCap,
+                                beam=args.beam,
+                                scorer=args.scorer,
+                                pairTable=args.pairTable,
+                                workers=args.workers)
+                              for con, pres in deAbbr(con, pres, abbr, calc)))
+        return
+
+    limit = (args.limit if issubclass(calc, LambekProof) 
+                         and not (args.countOnly or args.showTree)
+                         and args.traceMode != 'trace' else None)
+    total = 0
+    for con, pres in deAbbr(con, pres, abbr, calc):
+        if limit is not None and total >= limit: break
+        total += runSequent(calc, con, pres, args,
+                            None if limit is None else limit - total, store)
+
+    if not total: print('Total: 0\n')
+
+
+_job = {}
+
+def _initJob(calc, abbr, args):
+    _job.update(calc=calc, abbr=abbr, args=args,
+                store=args.store and ProofStore(args.store))
+
+
+def _captured(func, *args):
+    '''Run `func` in a worker, return its printed output and result.'''
+    with redirect_stdout(io.StringIO()) as out:
+        res = func(*args)
+    return out.getvalue(), res
+
+
+def _jobLine(line):
+    return _captured(runLine, line, _job['calc'], _job['abbr'], 
+                     _job['args'], _job['store'])
+
+
+def _jobSequent(task):
+    lineNo, con, pres = task
+    return lineNo, _captured(runSequent, _job['calc'], con, pres, 
+                             _job['args'], None, _job['store'])
+
+
+def _split(line):
+    con, *pres = line.split()
+    return con, pres
+
+
+def runJobs(lines, calc, abbr, args):
+    '''Spread the input over `args.jobs` processes.
+    Output is printed in input order.
+    Without `--limit` or `--decide`, every abbreviation expansion 
+    is a task of its own, and the totals are summed back per line;
+    otherwise every input line is a task.'''
+    with Pool(args.jobs, _initJob, (calc, abbr, args)) as pool:
+        if args.decide or args.limit is not None:
+            for out, _ in pool.imap(_jobLine, lines):
+                print(out, end='')
+            return
+
+        tasks = ((lineNo, con, pres)
+                 for lineNo, line in enumerate(lines)
+                 for con, pres in deAbbr(*_split(line), abbr, calc))
+        totals = [0] * len(lines)
+        done = 0
+        for lineNo, (out, count) in pool.imap(_jobSequent, tasks,
+                                              chunksize=args.chunkSize):
+            for k in range(done, lineNo):
+                if not totals[k]: print('Total: 0\n')
+            done = lineNo
+            print(out, end='')
+            totals[lineNo] += count
+        for k in range(done, len(lines)):
+            if not totals[k]: print('Total: 0\n')
+
+
 if __name__ == '__main__':
-    args = initArgParser().parse_args()
+    ap = initArgParser()
+    args = ap.parse_args()
+    args.scorer = WeightCost.load(args.scorer) if args.scorer else unslashCost
+    args.pairTable = (LockedCache(makeCache(None, args.cacheSize, 
+                                            args.cachePolicy))
+                      if args.cacheSize is not None else None)
 
     abbr = json.load(open(args.abbr))
     calc = CALC_DICT.get(args.calc, DisplaceProof)
+    if args.countOnly and issubclass(calc, Cntccg):
+        ap.error('--countOnly is not supported by continuized CCG')
     print(calc)
 
-    for line in open(args.input):
-        line = line.strip()
-        if line and not line.startswith('#'):
-            con, *pres = line.split()
-            total = 0
-            for con, pres in deAbbr(con, pres, abbr, calc):
-                con, pres, parser, _ = searchLinks(calc, con, pres, 
-                                                earlyCollapse=args.earlyCollapse,
-                                                islandFirst=args.islandFirst,
-                                                rruleFirst=args.rruleFirst,
-                                                gapLimit=args.gapLimit,
-                                                traceMode=args.traceMode)
-                total += parser.proofCount
-                if args.showTree and calc != ProofNet:
-                    printTree(con, pres, parser)
-                else:
-                    printLinks(con, pres, parser)
-
-            if not total: print('Total: 0\n')
+    lines = [line for line in map(str.strip, open(args.input))
+             if line and not line.startswith('#')]
+    if args.jobs > 1:
+        args.workers = None
+        runJobs(lines, calc, abbr, args)
+    else:
+        store = args.store and ProofStore(args.store)
+        for line in lines:
+            runLine(line, calc, abbr, args, store)
+        if store: store.close()
@@ -0,0 +1,49 @@
+'''Benchmark proof net chart parsing: chart size vs. time.
+Parse chains of quantified clauses of growing length and report the
+number of partial parses kept in the chart, the proofs and the time.
+
+    $ python bench/chartsize.py -n 4
+    $ python bench/chartsize.py -n 6 -w 4
+'''
+import argparse
+from time import perf_counter
+
+from lambekseq.atomlink import searchLinks
+from lambekseq.cmll import ProofNet
+
+
+CLAUSE = ['s/(np\\s)', '(np\\s)/np', '(s/np)\\s']
+CONJ = '(s\\s)/s'
+
+
+def chain(n):
+    '''`n` quantified clauses joined by a sentential conjunction.'''
+    pres = []
+    for k in range(n):
+        if k: pres.append(CONJ)
+        pres.extend(CLAUSE)
+    return 's', pres
+
+
+def run(con, pres, porder, workers=None):
+    start = perf_counter()
+    _, _, parser, _ = searchLinks(ProofNet, con, pres, porder=porder,
+                                  workers=workers)
+    chart = sum(map(len, parser._proofSpan.values()))
+    return parser.natom, chart, parser.proofCount, perf_counter() - start
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Proof net chart benchmark')
+    ap.add_argument('-n', '--clauses', default=4, type=int)
+    ap.add_argument('-p', '--porder', default='bits', choices=['bits', 'sets'])
+    ap.add_argument('-w', '--workers', default=None, type=int)
+    args = ap.parse_args()
+
+    print('%8s %8s %8s %10s %8s %8s' % (
+        'clauses', 'premises', 'atoms', 'chart', 'proofs', 'time(s)'))
+    for n in range(1, args.clauses + 1):
+        con, pres = chain(n)
+        natom, chart, proofs, t = run(con, pres, args.porder, args.workers)
+        print('%8d %8d %8d %10d %8d %8.3f' % (
+            n, len(pres), natom, chart, proofs, t))
@@ -0,0 +1,71 @@
+'''Benchmark atom-count pruning in Lambek/Displacement calculus.
+Compare the number of `findproof` calls and the time with and without
+`countPrune` over the sequents in `input` and the demo sentences.
+
+    $ python bench/countprune.py -i input -a abbr.json -s schema.json
+'''
+import json
+import argparse
+from time import perf_counter
+
+from lambekseq.atomlink import deAbbr, searchLinks
+from lambekseq.lbnoprod import LambekProof
+from lambekseq.displace import DisplaceProof
+
+
+DEMO_POS = ['ind n vt ind n',
+            'qnt n vt ind n',
+            'qnt n vt indl n',
+            'qnt n vt qnt n',
+            'qnt n vt qnt n pv qnt n',
+            'qnt n pn qnt n rl vi vi',
+            'qnt n rl vt ind n vt pro',
+            'prp vt cj prp vt pros n',
+            'prp vco qnt n inf vt ind n',
+            'prp vco cj prp vco prp inf vt ind n',
+            'prp vco prp cj prp vco prp inf vt ind n',
+            'prp vce prp inf vt qnt n',
+            'prp vts prp vt qnt n',
+            'prp vcs prp inf vt ind n',
+            'prp vtv inf vt ind n',
+            'qnt n cj qnt n vi']
+
+
+def loadSequents(inputPath, vocabPath):
+    '''Uncommented `input` lines and the demo sentences as `s` sequents.'''
+    seqs = [line.split() for line in map(str.strip, open(inputPath))
+            if line and not line.startswith('#')]
+    vocab = json.load(open(vocabPath))
+    for pos in DEMO_POS:
+        seqs.append(['s'] + [vocab[p]['cat'] for p in pos.split()])
+    return seqs
+
+
+def run(calc, seqs, abbr, countPrune):
+    calls = proofs = 0
+    start = perf_counter()
+    for con, *pres in seqs:
+        for con, pres in deAbbr(con, pres, abbr, calc):
+            _, _, parser, _ = searchLinks(calc, con, pres,
+                traceMode='count', countPrune=countPrune)
+            calls += getattr(parser, 'callCount', 0)
+            proofs += parser.proofCount
+    return calls, proofs, perf_counter() - start
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Atom-count pruning benchmark')
+    ap.add_argument('-i', '--input', default='input')
+    ap.add_argument('-a', '--abbr', default='abbr.json')
+    ap.add_argument('-s', '--schema', default='schema.json')
+    args = ap.parse_args()
+
+    abbr = json.load(open(args.abbr))
+    seqs = loadSequents(args.input, args.schema)
+    print('%-14s %8s %10s %10s %8s' % (
+        'calculus', 'prune', 'calls', 'proofs', 'time(s)'))
+    for calc in (LambekProof, DisplaceProof):
+        for countPrune in (False, True):
+            calls, proofs, t = run(calc, seqs, abbr, countPrune)
+            print('%-14s %8s %10d %10d %8.3f' % (
+                calc.__name__, countPrune, calls, proofs, t))
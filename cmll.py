@@ -1,9 +1,13 @@
 ''' Utilities for Cyclic Multiplicative Linear Logic (CMLL).
 '''
+from sys import getsizeof
 from collections import defaultdict
+from itertools import accumulate
 
-from lambekseq.lib.cterm import bipart, isatomic, atomicIden
-from lambekseq.lib.porder import PartialOrder, CyclicOrderError
+from lambekseq.lib.cterm import parseCat, atomicIden, atomCount
+from lambekseq.lib.porder import PORDER_BACKENDS, CyclicOrderError
+from lambekseq.lib.lca import EulerLCA
+from lambekseq.lib.wavefront import Wavefront
 
 
 Par = 'P'
@@ -30,14 +34,13 @@ def Neg(fm):
 
 def cat2cmll(s: str):
     '''product-free Lambek category -> CMLL formula'''
-    if isatomic(s):
-        return s
+    x = parseCat(s)
+    if x.isAtom:
+        return x.text
+    elif x.conn == '/':
+        return (cat2cmll(x.left), Par, Neg(cat2cmll(x.right)))
     else:
-        slash, left, right = bipart(s, noComma=True)
-        if slash == '/':
-            return (cat2cmll(left), Par, Neg(cat2cmll(right)))
-        else:
-            return (Neg(cat2cmll(left)), Par, cat2cmll(right))
+        return (Neg(cat2cmll(x.left)), Par, cat2cmll(x.right))
 
 
 def labelCmll(fm, natom, nconn):
@@ -55,6 +58,9 @@ def labelCmll(fm, natom, nconn):
 
 
 class Parse:
+    __slots__ = ['po', 'ends', 'links']
+    count = 1
+
     def __init__(self, po, ends=(), links=frozenset()):
         self.po = po
         self.ends = ends
@@ -73,9 +79,45 @@ class Parse:
         return str(self.links)
 
 
+class State(Parse):
+    '''A partial parse without links, identified by its ends and partial order.'''
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return self.ends == other.ends and self.po == other.po
+
+    def __hash__(self):
+        return hash((self.ends, self.po))
+
+
+class Tally(State):
+    '''A `State` standing for `count` partial parses.'''
+    __slots__ = ['count']
+
+    def __init__(self, po, ends=(), links=frozenset(), count=1):
+        State.__init__(self, po, ends, links)
+        self.count = count
+
+
+NODES = dict(parse=Parse, decide=State, count=Tally)
+
+
 class ProofNet:
-    def __init__(self, fm):
+    _symbolOnly = True
+
+    def __init__(self, fm, *, porder='bits', chartGC=False, chartStats=False,
+                              workers=None):
+        '''`porder` chooses a backend of partial orders from `lib.porder`.
+        If `chartGC`, chart cells are dropped once no longer needed, 
+        and only the cell of proofs is kept after parsing.
+        If `chartStats`, the peak size of the chart is kept in `chartStats`.
+        If `workers`, the chart is filled by that many processes, 
+        see `lib.wavefront`.'''
         D = labelCmll(fm, 0, 0)
+        self.PartialOrder = PORDER_BACKENDS[porder]
+        self._chartGC = chartGC
+        self._workers = workers
+        self.chartStats = dict(peakParses=0, peakBytes=0) if chartStats else None
         self.fm = fm
         self.labFm, self.natom, self.nconn = D['fm'], D['natom'], D['nconn']        
         self.adict = {}                        # alab to symbol
@@ -84,8 +126,10 @@ class ProofNet:
         self.aAnces = {}                       # ancestors of atoms
         self.po = set()
         self.__prepare(self.labFm, [0])
-        self.mca = {(i, j): self.__minCommonAnces(self.aAnces[i], self.aAnces[j]) 
-                    for i in self.adict for j in self.adict}
+        self.__lca = EulerLCA(0, {c: trace[0] for c, trace in self.cAnces.items() 
+                                  if trace})
+        self.__aParent = [self.aAnces[a][0] for a in range(self.natom)]
+        self.__prepareAtoms()
            
     def __prepare(self, fm, trace):
         if 'alab' in fm:
@@ -104,22 +148,47 @@ class ProofNet:
         return cls(cat2cmll(s))
 
     @classmethod
-    def fromLambekSeq(cls, con:str, pres:list, *, symbolOnly=True, **kwargs):
+    def fromLambekSeq(cls, con:str, pres:list, *, symbolOnly=True, 
+                                                  porder='bits', 
+                                                  chartGC=False,
+                                                  chartStats=False,
+                                                  workers=None, **kwargs):
         '''Show only symbol pairs when printing proofs if `symbolOnly`.'''
-        cls._symbolOnly = symbolOnly
         fm = cat2cmll(con)
         for p in pres:
             fm = (Neg(cat2cmll(p)), Par, fm)
-        return cls(fm)
+        pn = cls(fm, porder=porder, chartGC=chartGC, chartStats=chartStats,
+                 workers=workers)
+        pn._symbolOnly = symbolOnly
+        return pn
 
     @property
     def proofs(self):
-        return self._proofSpan[0, self.natom - 1]
+        return list(self._proofSpan[0, self.natom - 1].values())
 
     @property
     def proofCount(self):
         return len(self.proofs)
 
+    @property
+    def storeOptions(self):
+        '''Options that the proofs depend on, see `lib.store`.'''
+        return {}
+
+    def dumpProofs(self):
+        '''Proofs as sets of pairs of atoms.'''
+        a = lambda x: self.adict[x].replace('~', '')
+        return [frozenset(tuple(sorted((a(x), a(y)))) for x, y in parse.links)
+                for parse in self.proofs]
+
+    def loadProofs(self, proofs):
+        '''Take `proofs` (see `dumpProofs`) instead of parsing.'''
+        alab = {v.replace('~', ''): k for k, v in self.adict.items()}
+        parses = (Parse(None, links=frozenset((alab[x], alab[y]) for x, y in p))
+                  for p in proofs)
+        self._proofSpan = {(0, self.natom - 1): 
+                           {parse.links: parse for parse in parses}}
+
     def printProofs(self):
         a = lambda x, y: ((self.adict[x], self.adict[y])
                           if isNeg(self.adict[x]) else
@@ -131,84 +200,344 @@ class ProofNet:
             print(', '.join(s), end='\n' if self._symbolOnly else '\n\n')
         if self._symbolOnly: print()
 
-    @staticmethod
-    def __minCommonAnces(seq1, seq2):
-        for x in seq1:
-            if x in seq2: return x
-        else:
-            raise Exception('Disjoint sequences given.')
+    def __prepareAtoms(self):
+        '''Map atoms to type symbols and polarities once. Then atom `k` 
+        can be linked to atom `i` iff bit `k` of `_compat[i]` is set,
+        and `__countSum` are the prefix sums of their atom counts.'''
+        types = [(parseCat(x.replace('~', '')).symbol, isNeg(x))
+                 for x in map(self.adict.get, range(self.natom))]
+        masks = defaultdict(int)
+        for a, t in enumerate(types):
+            masks[t] |= 1 << a
+        self._compat = [masks[symbol, not neg] for symbol, neg in types]
+        self.__countSum = list(accumulate(
+            ((-1 if neg else 1) * atomCount(symbol) for symbol, neg in types),
+            initial=0))
+
+    def balanced(self, i, k):
+        '''Check if atoms `i` to `k` have as many negative occurrences
+        as positive ones of every type, which a matching of them needs.
+        Counts of all types are packed in one integer (see `atomCount`).'''
+        return self.__countSum[k + 1] == self.__countSum[i]
+
+    def lastUse(self, i, k):
+        '''The last step of chart parsing that reads the cell of `(i, k)`:
+        it is a part of `(i, natom - 1)` and `(0, k)`, and the inside
+        of `(i - 1, k + 1)`.'''
+        return max(self.natom - 1 - i, k, k - i + 2)
 
-    def __TPSplit(self, conns):
+    @staticmethod
+    def chartSize(span):
+        '''Return the number of parses in the chart `span`, and an estimate
+        of the bytes held by the chart, counting shared partial orders once.'''
+        parses = nbytes = 0
+        pos = {}
+        for cell in span.values():
+            nbytes += getsizeof(cell)
+            for node in cell.values():
+                parses += 1
+                nbytes += (getsizeof(node) + getsizeof(node.ends) 
+                           + getsizeof(node.links))
+                pos[id(node.po)] = node.po
+        return parses, nbytes + sum(po.nbytes() for po in pos.values())
+
+    def __measure(self, span):
+        parses, nbytes = self.chartSize(span)
+        stats = self.chartStats
+        stats['peakParses'] = max(stats['peakParses'], parses)
+        stats['peakBytes'] = max(stats['peakBytes'], nbytes)
+
+    def mca(self, i, j):
+        '''The lowest connective above both atoms `i` and `j`.'''
+        return self.__lca(self.__aParent[i], self.__aParent[j])
+
+    def _TPSplit(self, conns):
         return ({c for c in conns if self.cdict[c] == Tensor}, 
                 {c for c in conns if self.cdict[c] == Par})
 
     def parse(self):
-        self.po = PartialOrder(set(self.cdict), self.po)
-        span = defaultdict(set)
-
-        for step in range(1, self.natom, 2):
-            for i in range(self.natom - step):
-                k = i + step
+        span = self.__fill('parse')
+        if self._chartGC:
+            span = {(0, self.natom - 1): span[0, self.natom - 1]}
+        self._proofSpan = span
 
-                if negIden(self.adict[i], self.adict[k]):
-                    if step == 1:
-                        adjacentCase = {Parse(PartialOrder(self.po.nodes, self.po.edges))}
+    @classmethod
+    def isProvable(cls, con:str, pres:list, **kwargs):
+        '''Decide if `pres -> con` is derivable without collecting links.'''
+        return cls.fromLambekSeq(con, pres, **kwargs).provable()
+
+    def provable(self):
+        '''Fill the chart with link-free `State`s and stop at the first
+        complete one.'''
+        return bool(self.__fill('decide')[0, self.natom - 1])
+
+    def countProofs(self):
+        '''Count the proofs without their links, and keep the number in 
+        `count`. A cell keeps the number of its parses of each ends and 
+        partial order in a `Tally`. A parse is made of two only where the
+        first links its first atom to its last, so each is counted once.
+        `countMethod` is set to 'tabulated'.'''
+        self.countMethod = 'tabulated'
+        cell = self.__fill('count')[0, self.natom - 1]
+        self.count = sum(node.count for node in cell.values())
+        return self.count
+
+    def __fill(self, mode):
+        '''Chart parsing. In the `parse` mode, partial parses are told apart
+        by their links; in the `decide` and `count` modes, by their ends 
+        and partial order only. A chart cell maps these keys to the first 
+        parse found (see `NODES`), and `decide` stops at the first proof.
+        Partial orders are never changed once made, so a parse extends
+        that of its parts with `extend`, and equal orders are shared.
+        With `workers`, the cells of each step are filled by a `Wavefront`.'''
+        self._mode = mode
+        self._po0 = self.PartialOrder(set(self.cdict), self.po)
+        self._pool = {}
+        span = defaultdict(dict)
+
+        if not self.balanced(0, self.natom - 1):
+            return span
+
+        wavefront = self._workers and Wavefront(self, self._workers)
+        try:
+            for step in range(1, self.natom, 2):
+                cells = [(i, i + step) for i in range(self.natom - step)
+                         if self.balanced(i, i + step)]
+                if wavefront and len(cells) > 1:
+                    span.update(wavefront.fill(span, cells))
+                else:
+                    for i, k in cells:
+                        span[i, k] = self._fillCell(span, i, k)
+
+                if self._chartGC:
+                    for cell in [c for c in span if self.lastUse(*c) <= step]:
+                        del span[cell]
+                        if wavefront: wavefront.drop(cell)
+                    self._pool.clear()
+                if self.chartStats is not None:
+                    self.__measure(span)
+        finally:
+            if wavefront: wavefront.close()
+
+        return span
+
+    def _cellInputs(self, i, k):
+        '''The cells that `_fillCell(span, i, k)` reads.'''
+        if k - i > 1 and self._compat[i] >> k & 1:
+            yield i + 1, k - 1
+        for j in range(i + 1, k - 1, 2):
+            if self.balanced(i, j):
+                yield i, j
+                yield j + 1, k
+
+    def _packCell(self, cell):
+        return [(node.ends, node.links, node.po.dump(), node.count) 
+                for node in cell.values()]
+
+    def _unpackCell(self, data):
+        Node = NODES[self._mode]
+        cell = {}
+        for ends, links, po, count in data:
+            self.__add(cell, Node(self.__share(self._po0.load(po)), ends, links), 
+                       count)
+        return cell
+
+    def __share(self, po):
+        return self._pool.setdefault(po, po)
+
+    def __add(self, cell, node, count=1):
+        '''Put `node`, which stands for `count` parses, in `cell`.'''
+        if self._mode == 'parse':
+            cell.setdefault(node.links, node)
+        else:
+            first = cell.setdefault((node.ends, node.po), node)
+            if self._mode == 'count':
+                if first is node: 
+                    node.count = count
+                else:
+                    first.count += count
+
+    def _fillCell(self, span, i, k):
+        '''Fill the cell of atoms `i` to `k` from the shorter ones in `span`.
+        In the `decide` mode, stop at the first parse of the whole sequent.'''
+        add, share = self.__add, self.__share
+        linked, decide = self._mode == 'parse', self._mode == 'decide'
+        Node = NODES[self._mode]
+        step = k - i
+        cell = {}
+
+        if self._compat[i] >> k & 1:
+            if step == 1:
+                inside = [Node(self._po0)]
+            else:
+                inside = span[i + 1, k - 1].values()
+
+            for parse in inside:
+                ends = (i,) + parse.ends + (k,)
+                links = parse.links | {(i, k)} if linked else parse.links
+
+                inConn = {self.mca(ends[i], ends[i + 1]) for i in range(0, len(ends) - 1, 2)}
+                inTensors, inPars = self._TPSplit(inConn)
+                if inPars:
+                    inPar = inPars.pop()                        
+                    if not inPars:
+                        newEdges = {(t, inPar) for t in inTensors}
+                        try:
+                            newPo = parse.po.extend(newEdges)
+                        except CyclicOrderError:
+                            pass
+                        else:
+                            add(cell, Node(share(newPo), (i, k), links), parse.count)
+                            if decide and step == self.natom - 1:
+                                return cell
+              
+        for j in range(i + 1, k - 1, 2):
+            if not self.balanced(i, j): continue
+            for parse1 in span[i, j].values():
+                if self._mode == 'count' and parse1.ends != (i, j):
+                    continue
+                for parse2 in span[j + 1, k].values():
+                    ends = parse1.ends + parse2.ends
+                    links = parse1.links | parse2.links
+                    
+                    if linked and links in cell:
+                        continue
+
+                    try:
+                        po = parse1.po.join(parse2.po)
+                    except CyclicOrderError:
+                        pass
                     else:
-                        adjacentCase = set()
-
-                    for parse in span[i + 1, k - 1] | adjacentCase:
-                        ends = (i,) + parse.ends + (k,)
-                        links = parse.links | {(i, k)}
-
-                        inConn = {self.mca[ends[i], ends[i + 1]] for i in range(0, len(ends) - 1, 2)}
-                        inTensors, inPars = self.__TPSplit(inConn)
-                        if inPars:
-                            inPar = inPars.pop()                        
-                            if not inPars:
-                                newEdges = {(t, inPar) for t in inTensors}
-                                newPo = PartialOrder(parse.po.nodes, parse.po.edges)
-                                try:
-                                    newPo.addEdgesFrom(newEdges)
-                                except CyclicOrderError:
-                                    pass
-                                else:
-                                    span[i, k].add(Parse(newPo, (i, k), links))
-                      
-                for j in range(i + 1, k - 1, 2):
-                    for parse1 in span[i, j]:
-                        for parse2 in span[j + 1, k]:
-                            ends = parse1.ends + parse2.ends
-                            links = parse1.links | parse2.links
-                            
-                            for parse in span[i, k]:
-                                if links == parse.links: break
-                            
-                            else:
-                                newEdges = parse2.po - parse1.po
-                                newPo = PartialOrder(parse1.po.nodes, parse1.po.edges)
+                        if step < self.natom - 1:
+                            add(cell, Node(share(po), ends, links), 
+                                parse1.count * parse2.count)
+                        else:
+                            exConn = {self.mca(ends[i], ends[i + 1]) for i in range(1, len(ends) - 2, 2)}
+                            exTensors, exPars = self._TPSplit(exConn)
+                            exPars.add(0)
+                            if len(exPars) == 1:
+                                newEdges = {(t, 0) for t in exTensors}
                                 try:
-                                    newPo.addEdgesFrom(newEdges)
+                                    newPo = po.extend(newEdges)
                                 except CyclicOrderError:
                                     pass
                                 else:
-                                    po = newPo
-                                    if step < self.natom - 1:
-                                        span[i, k].add(Parse(po, ends, links))
-                                    else:
-                                        exConn = {self.mca[ends[i], ends[i + 1]] for i in range(1, len(ends) - 2, 2)}
-                                        exTensors, exPars = self.__TPSplit(exConn)
-                                        exPars.add(0)
-                                        if len(exPars) == 1:
-                                            newEdges = {(t, 0) for t in exTensors}
-                                            newPo = PartialOrder(po.nodes, po.edges)
-                                            try:
-                                                newPo.addEdgesFrom(newEdges)
-                                            except CyclicOrderError:
-                                                pass
-                                            else:
-                                                span[i, k].add(Parse(newPo, ends, links))
+                                    add(cell, Node(newPo, ends, links),
+                                        parse1.count * parse2.count)
+                                    if decide: return cell
+
+        return cell
+
+
+class MergedProofNet(ProofNet):
+    '''Proof net recognizer for product-free Lambek sequents that merges
+    partial linkings in the chart.
+
+    `ProofNet` keeps every planar linking of an interval of atoms. Here
+    linkings of an interval that no longer differ for the rest of the
+    sequent are merged. Such a linking matters to the rest only through:
+     - the first and last atoms linked at its top level;
+     - the par between its top-level links, if any (two of them
+       leave no par to wrap them or to close the sequent);
+     - its partial order, restricted to the connectives above atoms
+       outside the interval and that par. The tensors between its 
+       top-level links are only ever put below a par, so they are 
+       replaced by one `pending` node above them.
+    No bound on their number is known here; merging only pays when many
+    linkings share a state, and otherwise costs more than `ProofNet`.
+    One linking is kept per state as a witness, so `parse` finds at
+    most one proof, and `proofCount` is 0 or 1.
+    '''
+    pending = -1
+
+    def __init__(self, fm, **kwargs):
+        kwargs['porder'] = 'bits'
+        ProofNet.__init__(self, fm, **kwargs)
+        lo, hi = {}, {}
+        for a, trace in self.aAnces.items():
+            for c in trace:
+                lo[c], hi[c] = min(lo.get(c, a), a), max(hi.get(c, a), a)
+        self.__connSpan = [(c, lo[c], hi[c]) for c in self.cdict if c in lo]
 
-        self._proofSpan = span
+    def parse(self):
+        links = self.__fill()
+        self._proofSpan = {(0, self.natom - 1): 
+            {} if links is None else {links: Parse(None, links=links)}}
+
+    def provable(self):
+        return self.__fill() is not None
+
+    def __fill(self):
+        '''Chart parsing over states `(first, last, par, po)`. 
+        Return the links of the first proof found, or `None`.'''
+        if not self.balanced(0, self.natom - 1):
+            return None
+
+        V = self.pending
+        po0 = self.PartialOrder(set(self.cdict) | {V}, self.po)
+        bit = {c: 1 << po0.index[c] for c in po0.index}
+        outside = {}
+        def keep(i, k, *extra):
+            '''Bitmask of the connectives above atoms out of `i` to `k`,
+            and of `extra`.'''
+            if (i, k) not in outside:
+                outside[i, k] = sum(bit[c] for c, a, b in self.__connSpan 
+                                    if a < i or b > k)
+            return outside[i, k] | sum(bit[c] for c in extra if c is not None)
+
+        span = defaultdict(dict)
+        empty = {(None, None, None, po0): frozenset()}
+        for step in range(1, self.natom, 2):
+            last = step == self.natom - 1
+            for i in range(self.natom - step):
+                k = i + step
+                if not self.balanced(i, k): continue
+                cell = span[i, k]
+
+                if self._compat[i] >> k & 1:
+                    inside = empty if step == 1 else span[i + 1, k - 1]
+                    for (first, end, par, po), links in list(inside.items()):
+                        if first is None:
+                            inConn = {self.mca(i, k)}
+                        else:
+                            inConn = {par, self.mca(i, first), self.mca(end, k)} - {None}
+                        inTensors, inPars = self._TPSplit(inConn)
+                        if len(inPars) != 1: continue
+                        inPar = inPars.pop()
+                        try:
+                            newPo = po.extend({(t, inPar) for t in inTensors | {V}})
+                        except CyclicOrderError:
+                            continue
+                        links = links | {(i, k)}
+                        if last:
+                            return links
+                        state = (i, k, None, newPo.project(keep(i, k)))
+                        cell.setdefault(state, links)
+
+                for j in range(i + 1, k - 1, 2):
+                    if not self.balanced(i, j): continue
+                    for (first, end1, par1, po1), links1 in span[i, j].items():
+                        for (first2, end, par2, po2), links2 in span[j + 1, k].items():
+                            c = self.mca(end1, first2)
+                            pars = {par1, par2} - {None}
+                            if self.cdict[c] == Par: pars.add(c)
+                            if len(pars) > 1 or last and pars - {0}: continue
+                            par = pars.pop() if pars else None
+                            try:
+                                po = po1.join(po2)
+                                if self.cdict[c] == Tensor:
+                                    po = po.extend({(c, V)})
+                                if last:
+                                    po.extend({(V, 0)})
+                            except CyclicOrderError:
+                                continue
+                            links = links1 | links2
+                            if last:
+                                return links
+                            state = (first, end, par, po.project(keep(i, k, V, par)))
+                            cell.setdefault(state, links)
+
+        return None
 
 
 def selfTest():
@@ -1,40 +1,49 @@
 '''Continuized CCG with generalized application, lifting and lowering.
 '''
+import json
+from hashlib import sha1
 from collections import defaultdict
 
-from lambekseq.lbnoprod import usecache
-from lambekseq.lib.cterm import towerSplit, catIden
-from lambekseq.lib.cterm import unslash, addHypo
+from lambekseq.lib.cterm import parseCat, towerSplit, catIden
+from lambekseq.lib.cterm import unslash, addHypo, renameAtoms, Category
+from lambekseq.lib.cache import LRUCache, LockedCache, Missing
 from lambekseq.lib.tobussccg import toBussCcg
+from lambekseq.lib.wavefront import Wavefront
 
 
-Conns = {'/', '\\', '^', '!'}
-towerSplit = usecache(towerSplit)
+class Result:
+    '''Immutable category `cat` of a span with the atom `links` of its 
+    derivation. The hash is computed once; `collapse`, `lift` and 
+    `propogate` return new results.'''
+    __slots__ = ['cat', 'links', '_hash']
 
+    def __init__(self, cat:Category, links=frozenset()):
+        object.__setattr__(self, 'cat', cat)
+        object.__setattr__(self, 'links', links)
+        object.__setattr__(self, '_hash', hash((cat, links)))
 
-class Result:
-    def __init__(self, cat:str, links=frozenset()):
-        self.cat = cat
-        self.links = links
+    def __setattr__(self, name, value):
+        raise AttributeError('Result is immutable')
+
+    def __reduce__(self):
+        return Result, (self.cat, self.links)
 
     def __iter__(self):
         return iter(self.links)
 
     def __eq__(self, other):
-        return (self.cat == other.cat
+        return (self._hash == other._hash
+            and self.cat == other.cat
             and self.links == other.links)
 
     def __hash__(self):
-        return hash((self.cat, self.links))
+        return self._hash
 
     def __repr__(self):
-        return self.cat
-
-    def __add__(self, others):
-        return reduce(self, others)
+        return self.cat.text
 
     @staticmethod
-    def _lowering(s:str):
+    def _lowering(s:Category):
         a, d, e = towerSplit(s)
         if not d: 
             return a, frozenset()
@@ -51,9 +60,15 @@ class Result:
     def collapse(self):
         '''Recursive lowering.'''
         cat, pairs = self._lowering(self.cat)
-        self.cat = cat
-        self.links |= pairs
-        return self
+        return Result(cat, self.links | pairs)
+
+    def lift(self, a, b):
+        '''The tower `(b^cat)!a` over this result.'''
+        return Result(addHypo(a, '!', addHypo(b, '^', self.cat)), self.links)
+
+    def propogate(self, xlist, ylist, i, j):
+        '''This result of cell (i, j) propogated back to (0, 0).'''
+        return Result(propogate(xlist, ylist, i, j, self.cat), self.links)
 
 
 def propogate(xlist, ylist, i, j, cat):
@@ -65,7 +80,7 @@ def propogate(xlist, ylist, i, j, cat):
     return cat
 
 
-def cellAppl(xlist, ylist, i, j, slash):
+def cellAppl(xlist, ylist, i, j, slash, earlyCollapse=True, table=None):
     if i < len(xlist) - 1:
         if xlist[i + 1][1] == slash:
             iden, pairs = catIden(xlist[i + 1][2], ylist[j][0])
@@ -77,20 +92,20 @@ def cellAppl(xlist, ylist, i, j, slash):
         c, a, b = towerSplit(ylist[j][0])
         if a:
             if slash == '/':
-                res = reduce(Result(xlist[i][0]), Result(c))
+                res = reduce(Result(xlist[i][0]), Result(c), 
+                             earlyCollapse, table)
             elif slash == '\\':
-                res = reduce(Result(c), Result(xlist[i][0]))                
-            for r in res:
-                r.cat = addHypo(b, '^', r.cat)
-                r.cat = addHypo(a, '!', r.cat)
-                if r._earlyCollapse: r.collapse()
-                r.cat = propogate(xlist, ylist, i, j, r.cat)
-            return {r for r in res}
+                res = reduce(Result(c), Result(xlist[i][0]), 
+                             earlyCollapse, table)
+            res = (r.lift(a, b) for r in res)
+            if earlyCollapse: 
+                res = (r.collapse() for r in res)
+            return {r.propogate(xlist, ylist, i, j) for r in res}
     
     return set()
 
 
-def reduce(x:Result, y:Result) -> set:
+def _reduce(x:Result, y:Result, earlyCollapse=True, table=None) -> set:
     '''Use only the 0-th row and 0-th column of the reduction table'''
     xlist, ylist = unslash(x.cat), unslash(y.cat)
     
@@ -100,41 +115,171 @@ def reduce(x:Result, y:Result) -> set:
             j  = s - i
             if (i and j or i >= len(xlist)
                         or j >= len(ylist)): continue
-            res.update(cellAppl(xlist, ylist, i, j, '/'))
-            res.update(cellAppl(ylist, xlist, j, i, '\\'))
+            res.update(cellAppl(xlist, ylist, i, j, '/', earlyCollapse, table))
+            res.update(cellAppl(ylist, xlist, j, i, '\\', earlyCollapse, table))
 
         if res: break
     
+    return res
+
+
+PAIR_TABLE = LockedCache(LRUCache(1 << 16))
+
+
+def pairKey(x:Category, y:Category):
+    '''The key of `x, y` in a pair table (see `reduceCats`): their shapes
+    and the pattern of atom occurrences, so that pairs equal up to a 
+    renaming of atoms share an entry, across cells and sentences.'''
+    local = {}
+    return x.shape, y.shape, tuple(local.setdefault(a.text, len(local))
+                                   for a in x.atoms + y.atoms)
+
+
+def reduceCats(x:Category, y:Category, earlyCollapse=True, table=None) -> list:
+    '''Combine `x` and `y` into a list of result categories, each with 
+    the links the reduction adds. Memoized in `table`, by default the
+    shared `PAIR_TABLE`.'''
+    if table is None: table = PAIR_TABLE
+    atoms = x.atoms + y.atoms
+    key = pairKey(x, y), earlyCollapse
+    entry = table.get(key)
+    if entry is Missing:
+        entry = atoms, [(r.cat, r.links) for r in 
+                        _reduce(Result(x), Result(y), earlyCollapse, table)]
+        table.put(key, entry)
+
+    other, res = entry
+    if other == atoms:
+        return res
+
+    names = {a.text: b for a, b in zip(other, atoms)}
+    return [(renameAtoms(cat, names), 
+             frozenset(tuple(sorted({names[a].text for a in pair}))
+                       for pair in pairs))
+            for cat, pairs in res]
+
+
+def reduce(x:Result, y:Result, earlyCollapse=True, table=None) -> set:
+    '''Combine `x` and `y` by `reduceCats`, adding their links.'''
     xyLinks = x.links | y.links
-    for r in res: r.links |= xyLinks
-    return {r for r in res}
+    return {Result(cat, pairs | xyLinks) 
+            for cat, pairs in reduceCats(x.cat, y.cat, earlyCollapse, table)}
+
+
+def unslashCost(cat:Category):
+    '''The complexity of `cat` as the length of its `unslash` list.'''
+    return len(unslash(cat))
+
+
+class WeightCost:
+    '''Costs of categories by their shapes in `weights`, e.g. learned
+    weights loaded from a JSON file by `load`. Other shapes cost `default`.'''
+    def __init__(self, weights:dict, default=0.):
+        self.weights = weights
+        self.default = default
+
+    def __call__(self, cat:Category):
+        return self.weights.get(cat.shape, self.default)
+
+    def __repr__(self):
+        table = json.dumps([self.weights, self.default], sort_keys=True)
+        return 'WeightCost(%s)' % sha1(table.encode()).hexdigest()[:12]
+
+    @classmethod
+    def load(cls, path, default=0.):
+        with open(path) as f:
+            return cls(json.load(f), default)
+
+
+class Cell(dict):
+    '''A cell of the packed chart (see `Cntccg.parse`), with the number
+    of categories `pruned` from it.'''
+    __slots__ = ['pruned']
+
+    def __init__(self, items=(), pruned=0):
+        dict.__init__(self, items)
+        self.pruned = pruned
 
 
 class Cntccg:
     def __init__(self, con:str, pres:list, *,
-                       matchCon=True, earlyCollapse=True, **kwargs):
+                       matchCon=True, earlyCollapse=True, workers=None,
+                       cellCap=None, beam=None, scorer=unslashCost,
+                       pairTable=None, **kwargs):
+        '''If `workers`, the chart is filled by that many processes, 
+        see `lib.wavefront`.
+        Cells below the whole span keep the categories within `beam` of
+        the lowest cost by `scorer` (lower is better), and at most
+        `cellCap` of them, if given. This trades proofs for time; see
+        `pruneStats` for what was dropped.
+        `pairTable` memoizes category pairs (see `reduceCats`), a cache 
+        from `lib.cache` safe to share between threads, as `LockedCache`
+        makes it; by default `PAIR_TABLE`, shared by all parsers.'''
         self.con = con
         self.pres = list(pres)
-        Cntccg._matchCon = matchCon
-        Result._earlyCollapse = earlyCollapse
-        towerSplit.cache.clear()
+        self._matchCon = matchCon
+        self._earlyCollapse = earlyCollapse
+        self._workers = workers
+        self._cellCap = cellCap
+        self._beam = beam
+        self._scorer = scorer
+        self.pairTable = PAIR_TABLE if pairTable is None else pairTable
+        self._proofSpan = {}
+        self._filled = 0
+        self._links = {}
+        self._allProofs = None
+        self._tops = {}
+        self._tree = {}
 
     def __len__(self):
         return len(self.pres)
 
+    @property
+    def cacheStats(self):
+        return self.pairTable.stats
+
     @property
     def allProofs(self):
-        return self._proofSpan[0, len(self) - 1]
+        '''The results of the whole span. Their link sets are only
+        built from the chart here, at the first call.'''
+        if self._allProofs is None:
+            self._allProofs = self._extract()
+        return self._allProofs
 
     @property
     def proofs(self):
-        return list(filter(lambda r: catIden(r.cat, self.con)[0], 
+        con = parseCat(self.con)
+        return list(filter(lambda r: catIden(r.cat, con)[0], 
                     self.allProofs))
 
     @property
     def proofCount(self):
         return len(self.proofs if self._matchCon else self.allProofs)
 
+    @property
+    def storeOptions(self):
+        '''Options that the proofs depend on, see `lib.store`.'''
+        options = dict(earlyCollapse=self._earlyCollapse,
+                       matchCon=self._matchCon)
+        if self._cellCap is not None or self._beam is not None:
+            options.update(cellCap=self._cellCap, beam=self._beam,
+                           scorer=getattr(self._scorer, '__name__', 
+                                          repr(self._scorer)))
+        return options
+
+    def dumpProofs(self):
+        '''Proofs as sets of pairs of atoms.'''
+        return [r.links for r in 
+                (self.proofs if self._matchCon else self.allProofs)]
+
+    def loadProofs(self, proofs):
+        '''Take `proofs` (see `dumpProofs`) instead of parsing.
+        Their categories are taken to be the conclusion.'''
+        con = parseCat(self.con)
+        self._allProofs = [Result(con, frozenset(p)) for p in proofs]
+        self._tops = {}
+        self._tree = {}
+
     def printProofs(self):
         pool = self.proofs if self._matchCon else self.allProofs
         for r in pool:
@@ -143,7 +288,22 @@ class Cntccg:
         if pool: print()
 
     def buildTree(self):
-        self._tree = {k: v for k, v in self._tree.items()}
+        '''Map every result in the derivations of the proofs to the
+        pair of results it is first derived from.'''
+        tree = {}
+        def onCall(r, i, k, cat, links):
+            back = self._linkSets(i, k, cat)[links]
+            if back is not None:
+                j, x, xLinks, y, yLinks = back
+                sub1, sub2 = Result(x, xLinks), Result(y, yLinks)
+                tree[r] = sub1, sub2
+                onCall(sub1, i, j - 1, x, xLinks)
+                onCall(sub2, j, k, y, yLinks)
+
+        for r in self.allProofs:
+            if r in self._tops:
+                onCall(r, 0, len(self) - 1, *self._tops[r])
+        self._tree = tree
 
     def printTree(self, space='.' * 4):
         def onCall(proofs, indent=''):
@@ -165,11 +325,203 @@ class Cntccg:
             self.proofs if self._matchCon else self.allProofs)
 
     def parse(self):
-        '''CKY parsing.'''
+        '''CKY parsing into a packed chart: a cell maps each category
+        of its span to its derivations `(j, x, y, pairs)`, from category
+        `x` over `(i, j - 1)` and `y` over `(j, k)`, adding links `pairs`.
+        The work thus grows with the categories of a span, not with its
+        readings, whose link sets are left to `allProofs`.'''
+        self._proofSpan = span = {}
+        for i in range(len(self)):
+            span[i, i] = Cell({parseCat(self.pres[i]): []})
+
+        wavefront = self._workers and Wavefront(self, self._workers)
+        try:
+            for step in range(1, len(self)):
+                cells = [(i, i + step) for i in range(len(self) - step)]
+                if wavefront and len(cells) > 1:
+                    filled = wavefront.fill(span, cells)
+                else:
+                    filled = ((ik, self._fillCell(span, *ik)) for ik in cells)
+                for ik, cell in filled:
+                    span[ik] = cell
+        finally:
+            if wavefront: wavefront.close()
+
+        self._filled = len(self)
+        self._links = {}
+        self._reset()
+
+    def push(self, cat:str):
+        '''Add the premise `cat` at the right, and fill only the new
+        cells `(i, n)` ending with it, keeping the rest of the chart.
+        `proofs` and `allProofs` then stand for the premises so far.
+        Premises given but not yet parsed are filled in first.'''
+        self.pres.append(cat)
+        for n in range(self._filled, len(self)):
+            span = self._proofSpan
+            if n > 1 and not span[0, n - 1].pruned:
+                # no longer the whole span
+                span[0, n - 1] = self._prune(span[0, n - 1])
+            span[n, n] = Cell({parseCat(self.pres[n]): []})
+            for i in range(n - 1, -1, -1):
+                span[i, n] = self._fillCell(span, i, n)
+            self._filled = n + 1
+        self._reset()
+
+    def _reset(self):
+        '''Forget the proofs taken from the chart, once it changes.'''
+        self._tops = {}
+        self._allProofs = None
+        self._tree = {}
+
+    @property
+    def pruneStats(self):
+        '''The numbers of cells of the chart, of categories and 
+        derivations kept in them, and of categories pruned.'''
+        cells = [cell for (i, k), cell in self._proofSpan.items() if i < k]
+        return dict(cells=len(cells), 
+                    categories=sum(map(len, cells)),
+                    derivations=sum(len(derivs) for cell in cells 
+                                    for derivs in cell.values()),
+                    pruned=sum(cell.pruned for cell in cells))
+
+    def _linkSets(self, i, k, cat):
+        '''The link sets of `cat` over `(i, k)` in the chart, each mapped
+        to its first derivation `(j, x, xLinks, y, yLinks)`, or to `None` 
+        for a premise. Memoized in `_links`.'''
+        if (i, k, cat) not in self._links:
+            res = {}
+            derivs = self._proofSpan[i, k][cat]
+            if not derivs:
+                res[frozenset()] = None
+            for j, x, y, pairs in derivs:
+                for xLinks in self._linkSets(i, j - 1, x):
+                    for yLinks in self._linkSets(j, k, y):
+                        res.setdefault(pairs | xLinks | yLinks, 
+                                       (j, x, xLinks, y, yLinks))
+            self._links[i, k, cat] = res
+        return self._links[i, k, cat]
+
+    def _extract(self):
+        '''The results of the whole span, after lowering (unless done 
+        early) and matching the conclusion. `_tops` keeps the category 
+        and links in the chart of each.'''
+        con = parseCat(self.con)
+        n = len(self) - 1
+        res = set()
+        for cat in self._proofSpan[0, n]:
+            for links in self._linkSets(0, n, cat):
+                r = Result(cat, links)
+                if not self._earlyCollapse: r = r.collapse()
+                if self._matchCon: 
+                    r = Result(r.cat, r.links | catIden(r.cat, con)[1])
+                if r not in res:
+                    res.add(r)
+                    self._tops[r] = cat, links
+        return res
+
+    def _cellInputs(self, i, k):
+        '''The cells that `_fillCell(span, i, k)` reads.'''
+        for j in range(i + 1, k + 1):
+            yield i, j - 1
+            yield j, k
+
+    def _fillCell(self, span, i, k):
+        '''Reduce the pairs of cells splitting `(i, k)` in `span`.
+        Return the cell of the packed chart, see `parse`.'''
+        cell = {}
+        for j in range(i + 1, k + 1):
+            for x in span[i, j - 1]:
+                for y in span[j, k]:
+                    for cat, pairs in reduceCats(x, y, self._earlyCollapse,
+                                                 self.pairTable):
+                        cell.setdefault(cat, []).append((j, x, y, pairs))
+        if (i, k) == (0, len(self) - 1):
+            return Cell(cell)
+        return self._prune(cell)
+
+    def _prune(self, cell):
+        '''A `Cell` of the categories of `cell` within `beam` of the 
+        lowest cost, and at most `cellCap` of the cheapest of them.'''
+        if self._beam is None and self._cellCap is None or not cell:
+            return Cell(cell)
+
+        cost = {cat: self._scorer(cat) for cat in cell}
+        kept = sorted(cell, key=lambda cat: (cost[cat], cat.text))
+        if self._beam is not None:
+            best = cost[kept[0]]
+            kept = [cat for cat in kept if cost[cat] <= best + self._beam]
+        if self._cellCap is not None:
+            kept = kept[:self._cellCap]
+        kept = set(kept)
+        return Cell(((cat, derivs) for cat, derivs in cell.items() 
+                     if cat in kept), len(cell) - len(kept))
+
+    @staticmethod
+    def _packCell(cell):
+        '''Categories are packed as their texts.'''
+        return [(cat.text, [(j, x.text, y.text, pairs) 
+                            for j, x, y, pairs in derivs])
+                for cat, derivs in cell.items()], cell.pruned
+
+    @staticmethod
+    def _unpackCell(data):
+        items, pruned = data
+        return Cell(((parseCat(cat), [(j, parseCat(x), parseCat(y), pairs)
+                                      for j, x, y, pairs in derivs])
+                     for cat, derivs in items), pruned)
+
+    def countProofs(self):
+        '''Not supported: a proof is a set of links, and different 
+        bracketings of the chart may give the same one, so proofs cannot be 
+        counted without building their links. See `countDerivations`.'''
+        raise NotImplementedError('continuized CCG cannot count proofs '
+                                  'without building them; '
+                                  'see countDerivations')
+
+    def countDerivations(self):
+        '''Count the derivations in the packed chart (see `parse`), with
+        a number per (cell, category) instead of link sets. Derivations 
+        are not proofs: spurious bracketings are counted apart, so the 
+        number is at least `proofCount`.'''
+        self.parse()
+        counts = {}
+        def count(i, k, cat):
+            if (i, k, cat) not in counts:
+                derivs = self._proofSpan[i, k][cat]
+                counts[i, k, cat] = sum(count(i, j - 1, x) * count(j, k, y)
+                                        for j, x, y, _ in derivs) if derivs else 1
+            return counts[i, k, cat]
+
+        con = parseCat(self.con)
+        n = len(self) - 1
+        total = 0
+        for cat in self._proofSpan[0, n]:
+            r = Result(cat)
+            if not self._earlyCollapse: r = r.collapse()
+            if not self._matchCon or catIden(r.cat, con)[0]:
+                total += count(0, n, cat)
+        return total
+
+    @classmethod
+    def isProvable(cls, con, pres, **kwargs):
+        '''Decide if `pres -> con` is derivable without collecting links.'''
+        return cls(con, pres, **kwargs).provable()
+
+    def provable(self):
+        '''CKY over categories only, which stops at the first category
+        of the whole span that is accepted. Cells are pruned as in `parse`.'''
+        con = parseCat(self.con)
+        def accept(r):
+            if not self._earlyCollapse: r = r.collapse()
+            return not self._matchCon or catIden(r.cat, con)[0]
+
         span = defaultdict(set)
-        tree = {}
         for i in range(len(self)):
-            span[i, i] = {Result(self.pres[i])}
+            span[i, i] = {parseCat(self.pres[i])}
+
+        if len(self) == 1:
+            return any(accept(Result(x)) for x in span[0, 0])
 
         for step in range(1, len(self)):
             for i in range(len(self) - step):
@@ -177,21 +529,14 @@ class Cntccg:
                 for j in range(i + 1, k + 1):
                     for x in span[i, j - 1]:
                         for y in span[j, k]:
-                            res = x + y
-                            for r in res:
-                                if r not in tree: tree[r] = (x, y)
-                            span[i, k].update(res)
-
-        if not Result._earlyCollapse:
-            span[0, len(self) - 1] = {r.collapse()
-                for r in span[0, len(self) - 1]}
-
-        if self._matchCon:
-            for r in span[0, len(self) - 1]:
-                r.links |= catIden(r.cat, self.con)[1]
-
-        self._proofSpan = span
-        self._tree = tree
+                            for r in reduce(Result(x), Result(y), 
+                                            self._earlyCollapse, 
+                                            self.pairTable):
+                                if step == len(self) - 1 and accept(r):
+                                    return True
+                                span[i, k].add(r.cat)
+                span[i, k] = set(self._prune(dict.fromkeys(span[i, k])))
+        return False
 
 
 def selfTest():
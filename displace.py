@@ -2,14 +2,12 @@
 This script finds the axioms of every proof.
 Write `^` for upward arrow, '!' for downward arrow, '-' for gap.
 '''
-from lambekseq.lib.cterm import bipart, isatomic, atomicIden, catIden
-from lambekseq.lbnoprod import usecache, usetrace
+from lambekseq.lib.cterm import parseCat, catIden
 from lambekseq.lbnoprod import LambekProof
 
 
-Gap = '-'
-Conns = {'/', '\\', '^', '!'}
-Islands = {'s', 's^np'}
+Gap = parseCat('-')
+Islands = {parseCat('s'), parseCat('s^np')}
 
 
 def islandDiv(slash, left, right, islands=Islands):
@@ -20,6 +18,8 @@ def islandDiv(slash, left, right, islands=Islands):
 
 
 class DisplaceProof(LambekProof):
+    _storeOptions = ('_gapLimit', '_islandFirst', '_rruleFirst')
+
     def __init__(self, con, pres, *, traceMode='trace', 
                                      islandFirst=False, 
                                      rruleFirst=True, 
@@ -30,122 +30,121 @@ class DisplaceProof(LambekProof):
         self._islandFirst = islandFirst
         self._rruleFirst = rruleFirst
 
-        DisplaceProof.findproof = usetrace(traceMode)(DisplaceProof._findproof)
-        if traceMode == 'trace':
-            DisplaceProof.findproof.trace.clear()
-        elif traceMode == 'count':
-            DisplaceProof.findproof.callCount = 0
-
 
     def find_extract(self, con, pres, cut, left, right):
-        alts = set()
+        acc = self.prefixCounts(pres)
         for i in range(cut, -1, -1):
             for j in range(cut, len(pres)):
+                if (self._countPrune and acc[j + 1] - acc[i] 
+                        - pres[cut].count != left.count):
+                    continue
                 if pres[i:j + 1].count(Gap) < self._gapLimit:
-                    rightproof = self.findproof(con, *pres[:i], right, *pres[j + 1:])
-                    if rightproof:
-                        leftproof = self.findproof(left, *pres[i:cut], Gap, *pres[cut + 1:j + 1])
-                        alts.update({l | r for l in leftproof
-                                           for r in rightproof})
-        return alts
+                    yield 0, [(con, *pres[:i], right, *pres[j + 1:]),
+                              (left, *pres[i:cut], Gap, *pres[cut + 1:j + 1])]
 
 
     def find_insert(self, con, pres, cut, left, right):
         '''Deprecated: treating a type as a stack with zero power'''
-        leftproof = self.findproof(right)
-        if leftproof:
-            rightproof = self.findproof(con, *pres[:cut], left, *pres[cut + 1:])
-            return {l | r for l in leftproof
-                          for r in rightproof}
-        return set()
+        yield 0, [(right,), (con, *pres[:cut], left, *pres[cut + 1:])]
 
 
     def find_stack(self, con, base, expo):
-        alts = set()
-        if not expo: alts.update(self.findproof(con, *base))
-        if len(expo) == 1 and not isatomic(expo[0], conn=Conns):
-            ec, el, er = bipart(expo[0], conn=Conns, noComma=True)
-            if ec == '!':
-                leftproof = self.findproof(el, *base)
-                if leftproof:
-                    rightproof = self.findproof(con, er)
-                    alts.update({l | r for l in leftproof
-                                       for r in rightproof})
-        if len(base) == 1 and not isatomic(base[0], conn=Conns):
-            bc, bl, br = bipart(base[0], conn=Conns, noComma=True)
-            if bc == '^':
-                leftproof = self.findproof(br, *expo)
-                if leftproof:
-                    rightproof = self.findproof(con, bl)
-                    alts.update({l | r for l in leftproof
-                                       for r in rightproof})
-        return alts
-
-
-    @usecache
-    def _findproof(self, con, *pres):
-        pres = list(pres)
-        alts = set()
-        atomicCon = isatomic(con, conn=Conns)
-
+        if not expo: yield 0, [(con, *base)]
+        if len(expo) == 1 and not expo[0].isAtom:
+            e = expo[0]
+            if e.conn == '!' and self.balanced(e.left, base):
+                yield 0, [(e.left, *base), (con, e.right)]
+        if len(base) == 1 and not base[0].isAtom:
+            b = base[0]
+            if b.conn == '^' and self.balanced(b.right, expo):
+                yield 0, [(b.right, *expo), (con, b.left)]
+
+
+    def rules(self, con, pres):
         # when the conclusion is non-atomic
-        if not atomicCon:
-            conn, left, right = bipart(con, conn=Conns, noComma=True)
+        if not con.isAtom:
+            yield self.rightRules(con, pres)
+            if self._rruleFirst: return
+        
+        # when the conclusion is atomic or has no proof by right rules
+        yield self.leftRules(con, pres)
+
+
+    def rightRules(self, con, pres):
+        conn, left, right = con.conn, con.left, con.right
+        if conn == '/':
+            yield 0, [(left, *pres, right)]
+        elif conn == '\\':
+            yield 0, [(right, left, *pres)]
+        elif conn == '!':
+            yield from self.find_stack(right, [left], pres)
+        elif conn == '^':
+            ngaps = pres.count(Gap)
+            if ngaps == 0:
+                for i in range(len(pres) + 1):
+                    yield 0, [(con, *pres[:i], Gap, *pres[i:])]
+                yield from self.find_stack(left, pres, [right])
+            elif ngaps <= self._gapLimit:
+                for i in range(len(pres)):
+                    if pres[i] == Gap:
+                        yield 0, [(left, *pres[:i], right, *pres[i + 1:])]
+
+
+    def leftRules(self, con, pres):
+        nonatomPlain = []
+        nonatomIsland = []
+        for i in range(len(pres)):
+            if not pres[i].isAtom:
+                conn, left, right = pres[i].conn, pres[i].left, pres[i].right
+                if islandDiv(conn, left, right):
+                    nonatomIsland.append((i, conn, left, right))
+                else:
+                    nonatomPlain.append((i, conn, left, right))
+
+        for i, conn, left, right in nonatomIsland:
             if conn == '/':
-                alts = self.findproof(left, *pres, right)        
+                yield from self.find_diffTV(con, pres, i, left, right)
             elif conn == '\\':
-                alts = self.findproof(right, left, *pres)
-            elif conn == '!':
-                alts = self.find_stack(right, [left], pres)
-            elif conn == '^':
-                ngaps = pres.count(Gap)
-                if ngaps == 0:
-                    for i in range(len(pres) + 1):
-                        alts.update(self.findproof(con, *pres[:i], Gap, *pres[i:]))
-                    alts.update(self.find_stack(left, pres, [right]))
-                elif ngaps <= self._gapLimit:
-                    for i in range(len(pres)):
-                        if pres[i] == Gap:
-                            alts.update(self.findproof(left, *pres[:i], right, *pres[i + 1:]))
-            if alts or self._rruleFirst:
-                return alts
-        
-        # when the conclusion is atomic
-        if not alts:
-            nonatomPlain = []
-            nonatomIsland = []
-            for i in range(len(pres)):
-                if not isatomic(pres[i], conn=Conns):
-                    conn, left, right = bipart(pres[i], conn=Conns, noComma=True)
-                    if islandDiv(conn, left, right):
-                        nonatomIsland.append((i, conn, left, right))
-                    else:
-                        nonatomPlain.append((i, conn, left, right))
-
-            for i, conn, left, right in nonatomIsland:
+                yield from self.find_diffUT(con, pres, i, left, right)
+
+        if not (self._islandFirst and nonatomIsland):
+            for i, conn, left, right in nonatomPlain:
                 if conn == '/':
-                    alts.update(self.find_diffTV(con, pres, i, left, right))
+                    yield from self.find_diffTV(con, pres, i, left, right)
                 elif conn == '\\':
-                    alts.update(self.find_diffUT(con, pres, i, left, right))
-
-            if not (self._islandFirst and nonatomIsland):
-                for i, conn, left, right in nonatomPlain:
-                    if conn == '/':
-                        alts.update(self.find_diffTV(con, pres, i, left, right))
-                    elif conn == '\\':
-                        alts.update(self.find_diffUT(con, pres, i, left, right))
-                    elif conn == '!':
-                        alts.update(self.find_extract(con, pres, i, left, right))
-                    elif conn == '^':
-                        pass
-
-            if nonatomIsland or nonatomPlain:
-                return alts
-            else:
-                if len(pres) == 1 and atomicCon and atomicIden(pres[0], con):
-                    return {frozenset({tuple(sorted({pres[0], con}))})}
-                else:
-                    return set()
+                    yield from self.find_diffUT(con, pres, i, left, right)
+                elif conn == '!':
+                    yield from self.find_extract(con, pres, i, left, right)
+                elif conn == '^':
+                    pass
+
+        if not (nonatomIsland or nonatomPlain):
+            if len(pres) == 1 and con.isAtom and pres[0].symbol == con.symbol:
+                yield self.axiom(pres[0], con), []
+
+
+    def countProofs(self):
+        '''Count the proofs, see `LambekProof.countProofs`. Focused 
+        derivations are one per proof in the Lambek fragment only: the
+        right rules of `!` and `^` may need premises taken apart in some
+        order, and so may gaps under `gapLimit`, or `islandFirst`.
+        Other sequents have their proofs found untraced and counted,
+        which takes as long as `parse` without the trace; `countMethod`
+        is then 'enumerated' instead of 'tabulated'.'''
+        con, pres = self.prepare()
+        if (self._rruleFirst and not self._islandFirst 
+                and Gap not in pres 
+                and not any('^' in x.text or '!' in x.text for x in [con, *pres])):
+            return LambekProof.countProofs(self)
+
+        self.countMethod = 'enumerated'
+        findproof, self.findproof = self.findproof, self._findproof
+        try:
+            self.count = (len(self.findproof(con, *pres)) 
+                          if self.balanced(con, pres) else 0)
+        finally:
+            self.findproof = findproof
+        return self.count
 
 
 def selfTest():
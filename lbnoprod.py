@@ -1,17 +1,28 @@
 '''Product-free Lambek sequent calculus. 
 This script finds the axioms of every proof.
 '''
-from lambekseq.lib.cterm import isatomic, bipart, atomicIden
+from time import perf_counter
+from itertools import accumulate, islice
+
+from lambekseq.lib.cterm import parseCat, catAtoms
+from lambekseq.lib.cache import makeCache, Missing
 from lambekseq.lib.tobuss import toBuss
 
 
 def usecache(func):
-    def onCall(*args, **kwargs): 
-        if args not in onCall.cache:
-            onCall.cache[args] = func(*args, **kwargs)
-        return onCall.cache[args]
-    
-    onCall.cache = dict()
+    '''Memoize a prover method in the prover's own `cache`,
+    under the subgoal's `memoKey` (see `LambekProof.memoKey`).'''
+    def onCall(self, *args):
+        key = self.memoKey(args)
+        res = self.cache.get(key)
+        if res is Missing:
+            start = perf_counter()
+            res = func(self, *args)
+            self.cache.put(key, self.memo(args, res), perf_counter() - start)
+        else:
+            res = self.recall(res, args)
+        return res
+
     return onCall
 
 
@@ -20,10 +31,9 @@ def usetrace(mode):
         def onCall(*args, **kwargs):
             res = func(*args, **kwargs)
             if res: 
-                onCall.trace.append([args[1:], list(res)])
+                onCall.trace.append([tuple(map(str, args)), list(res)])
             return res
 
-        onCall.cache = func.cache
         onCall.trace = []
         return onCall
 
@@ -32,7 +42,6 @@ def usetrace(mode):
             onCall.callCount += 1
             return func(*args, **kwargs)
 
-        onCall.cache = func.cache
         onCall.callCount = 0
         return onCall
     
@@ -43,90 +52,432 @@ def usetrace(mode):
 
 
 class LambekProof:
-    def __init__(self, con, pres, *, traceMode='trace', **kwargs):
+    _storeOptions = ()
+
+    def __init__(self, con, pres, *, traceMode='trace', 
+                                     cache=None,
+                                     cacheSize=None,
+                                     cachePolicy='lru',
+                                     countPrune=True,
+                                     alphaKeys=True, **kwargs):
+        '''`cache` is a memo table from `lib.cache`. If not given, 
+        a new one of `cachePolicy` bounded by `cacheSize` entries is used.
+        Subgoals whose atom counts do not balance are skipped if `countPrune`.
+        Subgoals equal up to atom indices share memo entries if `alphaKeys`,
+        except in the `trace` mode, where a tree needs every subgoal traced.'''
         self.con = con
         self.pres = pres
         self.traceMode = traceMode
-                
-        LambekProof.findproof = usetrace(traceMode)(LambekProof._findproof)
-        if traceMode == 'trace':
-            LambekProof.findproof.trace.clear()
-        elif traceMode == 'count':
-            LambekProof.findproof.callCount = 0
-
+        self._countPrune = countPrune
+        self._alphaKeys = alphaKeys and traceMode != 'trace'
+        self.cache = makeCache(cache, cacheSize, cachePolicy)
+        self.decisions = makeCache(None, cacheSize, cachePolicy)
+        self.counts = makeCache(None, cacheSize, cachePolicy)
+        self.findproof = usetrace(traceMode)(self._findproof)
+
+
+    def prepare(self):
+        '''Clear the cache and return the parsed sequent.'''
+        self.cache.clear()
+        con, pres = parseCat(self.con), [parseCat(p) for p in self.pres]
+        self.numberAtoms(con, pres)
+        return con, pres
+
+
+    def parse(self, limit=None):
+        '''Find all proofs, or only the first `limit` ones (see `iterProofs`).
+        `limit` is ignored in the `trace` mode, whose trace needs every proof.'''
+        if limit is None or self.traceMode == 'trace':
+            con, pres = self.prepare()
+            if self.balanced(con, pres):
+                proofs = self.findproof(con, *pres)
+            else:
+                proofs = set()
+            self.proofs = {self.linkSet(p) for p in proofs}
+        else:
+            self.proofs = set(self.iterProofs(limit))
 
-    def parse(self):
-        self.findproof.cache.clear()
-        self.proofs = self.findproof(self.con, *self.pres)        
         if self.traceMode == 'trace':
-            self.trace = self.findproof.trace
+            self.trace = [[args, [self.linkSet(p) for p in res]] 
+                          for args, res in self.findproof.trace]
         elif self.traceMode == 'count':
             self.callCount = self.findproof.callCount
 
 
+    def numberAtoms(self, con, pres):
+        '''Number the atoms of the sequent from left to right.
+        Inside the search a link between the `i`-th and `j`-th atoms
+        (`i < j`) is the bit `i * natom + j` of an integer, 
+        and a proof is the union of such bits.'''
+        self._atoms = []
+        self._atomId = {}
+        self._links = {}
+        nonGap = 0
+        for x in [con] + pres:
+            for a in catAtoms(x):
+                nonGap += a.symbol != '-'
+                if a not in self._atomId:
+                    self._atomId[a] = len(self._atoms)
+                    self._atoms.append(a)
+        self._distinctAtoms = nonGap == sum(a.symbol != '-' for a in self._atoms)
+
+
+    def axiom(self, x, y):
+        '''The proof linking atoms `x` and `y`.'''
+        i, j = sorted((self._atomId[x], self._atomId[y]))
+        return 1 << (i * len(self._atoms) + j)
+
+
+    def linkSet(self, bits):
+        '''Decode an integer proof into a set of atom pairs.'''
+        links = set()
+        s = bin(bits)[:1:-1]
+        k = s.find('1')
+        while k >= 0:
+            if k not in self._links:
+                i, j = divmod(k, len(self._atoms))
+                self._links[k] = tuple(sorted({self._atoms[i].text, 
+                                               self._atoms[j].text}))
+            links.add(self._links[k])
+            k = s.find('1', k + 1)
+        return frozenset(links)
+
+
+    def memoKey(self, goal):
+        '''Return the memo key of `goal`. With `alphaKeys` the key is
+        the goal up to a renaming of atoms: the shapes of its categories,
+        and the pattern of atom occurrences unless the sequent's atoms 
+        are all distinct (as after `cindex.indexSeq`).'''
+        if not self._alphaKeys:
+            return goal
+        shapes = tuple(x.shape for x in goal)
+        if self._distinctAtoms:
+            return shapes
+        local = {}
+        return shapes, tuple(local.setdefault(a, len(local)) 
+                             for x in goal for a in x.atoms)
+
+
+    def memo(self, goal, proofs):
+        '''The memo entry of `proofs` of `goal`.'''
+        if not self._alphaKeys:
+            return proofs
+        return self._atomId, goal, proofs
+
+
+    def recall(self, entry, goal):
+        '''The proofs of `goal` from a memo entry, whose goal may differ
+        from `goal` by a renaming of atoms, or be numbered by another prover.'''
+        if not self._alphaKeys:
+            return entry
+        atomId, other, proofs = entry
+        if atomId is self._atomId and other == goal or not proofs:
+            return proofs
+
+        ids = {atomId.get(a): self._atomId.get(b)
+               for x, y in zip(other, goal) for a, b in zip(x.atoms, y.atoms)}
+        return self.renumber(proofs, len(atomId), ids, len(self._atoms))
+
+
+    @staticmethod
+    def renumber(proofs, n, ids, m):
+        '''Map the links of `proofs` over `n` atoms by `ids` to `m` atoms.'''
+        bits = {}
+        res = set()
+        for p in proofs:
+            q = 0
+            s = bin(p)[:1:-1]
+            k = s.find('1')
+            while k >= 0:
+                if k not in bits:
+                    i, j = sorted(map(ids.get, divmod(k, n)))
+                    bits[k] = 1 << (i * m + j)
+                q |= bits[k]
+                k = s.find('1', k + 1)
+            res.add(q)
+        return res
+
+
+    def balanced(self, con, pres):
+        '''Check the atom counts of `pres` against `con`.'''
+        return (not self._countPrune 
+                or sum(p.count for p in pres) == con.count)
+
+
+    @staticmethod
+    def prefixCounts(pres):
+        '''Atom counts of `pres[:j]` for every `j`.'''
+        return list(accumulate((p.count for p in pres), initial=0))
+
+
     def find_diffTV(self, con, pres, cut, left, right):
         U = pres[:cut]
-        alts = set()
+        acc = self.prefixCounts(pres)
         for j in range(cut + 1, len(pres) + 1):
+            if self._countPrune and acc[j] - acc[cut + 1] != right.count:
+                continue
             T, V = pres[cut + 1:j], pres[j:]
-            rightproof = self.findproof(right, *T)
-            if rightproof:
-                leftproof = self.findproof(con, *U, left, *V)
-                alts.update({r | l for r in rightproof 
-                                   for l in leftproof}) 
-        return alts
+            yield 0, [(right, *T), (con, *U, left, *V)]
 
 
     def find_diffUT(self, con, pres, cut, left, right):
         V = pres[cut + 1:]
-        alts = set()
+        acc = self.prefixCounts(pres)
         for j in range(cut + 1):
+            if self._countPrune and acc[cut] - acc[j] != left.count:
+                continue
             U, T = pres[:j], pres[j:cut]
-            leftproof = self.findproof(left, *T)
-            if leftproof:
-                rightproof = self.findproof(con, *U, right, *V)
-                alts.update({l | r for l in leftproof
-                                   for r in rightproof})
-        return alts
+            yield 0, [(left, *T), (con, *U, right, *V)]
 
 
-    @usecache
-    def _findproof(self, con, *pres):
-        '''Find proofs by showing the axiomatic premises.'''
+    def rules(self, con, pres):
+        '''Yield phases of rule applications to `pres -> con`.
+        A phase yields alternatives `(links, subgoals)`, whose proofs are 
+        `links` joined with a proof of each subgoal `(con, *pres)`.
+        A phase is tried only if the previous ones yield no proof.'''
         # when the conclusion is non-atomic
-        if not isatomic(con):
-            slash, left, right = bipart(con, noComma=True)
-            if slash == '/':
-                return self.findproof(left, *pres, right)
-            elif slash == '\\':
-                return self.findproof(right, left, *pres)
+        if not con.isAtom:
+            yield self.rightRules(con, pres)
 
         # when the conclusion is atomic
         else:
+            yield self.leftRules(con, pres)
+
+
+    def rightRules(self, con, pres):
+        if con.conn == '/':
+            yield 0, [(con.left, *pres, con.right)]
+        elif con.conn == '\\':
+            yield 0, [(con.right, con.left, *pres)]
+
+
+    def leftRules(self, con, pres):
+        hit_nonatomic = False
+        for i in range(len(pres)):
+            x = pres[i]
+            if not x.isAtom:
+                hit_nonatomic = True
+                if x.conn == '/':
+                    yield from self.find_diffTV(con, pres, i, x.left, x.right)
+                elif x.conn == '\\':
+                    yield from self.find_diffUT(con, pres, i, x.left, x.right)
+
+        if not hit_nonatomic:
+            if len(pres) == 1 and pres[0].symbol == con.symbol:
+                yield self.axiom(pres[0], con), []
+
+
+    @usecache
+    def _findproof(self, con, *pres):
+        '''Find proofs by showing the axiomatic premises.'''
+        for phase in self.rules(con, pres):
             alts = set()
-            hit_nonatomic = False
-            for i in range(len(pres)):
-                if not isatomic(pres[i]):
-                    hit_nonatomic = True
-                    slash, left, right = bipart(pres[i], noComma=True)
-                    if slash == '/':
-                        alts.update(self.find_diffTV(con, pres, i, left, right))
-                    elif slash == '\\':
-                        alts.update(self.find_diffUT(con, pres, i, left, right))
-
-            if hit_nonatomic:
-                return alts
+            for links, subgoals in phase:
+                proofs = {links}
+                for sub in subgoals:
+                    subproofs = self.findproof(*sub)
+                    if not subproofs: break
+                    proofs = {p | q for p in proofs for q in subproofs}
+                else:
+                    alts.update(proofs)
+            if alts: return alts
+        return set()
+
+
+    def _iterproof(self, goal):
+        '''Lazy `findproof`: yield distinct proofs of `goal` as found.
+        A goal is memoized only once its proofs are exhausted.'''
+        key = self.memoKey(goal)
+        proofs = self.cache.get(key)
+        if proofs is not Missing:
+            yield from self.recall(proofs, goal)
+            return
+
+        found = set()
+        for phase in self.rules(goal[0], goal[1:]):
+            for links, subgoals in phase:
+                for p in self._iterjoin(links, subgoals):
+                    if p not in found:
+                        found.add(p)
+                        yield p
+            if found: break
+        self.cache.put(key, self.memo(goal, found))
+
+
+    def _iterjoin(self, links, subgoals):
+        if not subgoals:
+            yield links
+        else:
+            for p in self._iterproof(subgoals[0]):
+                yield from self._iterjoin(links | p, subgoals[1:])
+
+
+    def iterProofs(self, limit=None):
+        '''Yield proofs one at a time as they are found, 
+        stopping after `limit` of them if given.'''
+        con, pres = self.prepare()
+        if self.balanced(con, pres):
+            proofs = self._iterproof((con, *pres))
+            for p in islice(proofs, limit):
+                yield self.linkSet(p)
+            proofs.close()
+
+
+    @classmethod
+    def isProvable(cls, con, pres, **kwargs):
+        '''Decide if `pres -> con` is derivable without collecting links.'''
+        return cls(con, pres, traceMode='none', **kwargs).provable()
+
+
+    def provable(self):
+        '''Stop at the first proof found, memoizing booleans in `decisions`.'''
+        self.decisions.clear()
+        con, pres = self.prepare()
+        return self.balanced(con, pres) and self._decide((con, *pres))
+
+
+    def _decide(self, goal):
+        key = self.memoKey(goal)
+        res = self.decisions.get(key)
+        if res is Missing:
+            start = perf_counter()
+            res = any(any(all(self._decide(sub) for sub in subgoals)
+                          for _, subgoals in phase)
+                      for phase in self.rules(goal[0], goal[1:]))
+            self.decisions.put(key, res, perf_counter() - start)
+        return res
+
+
+    def countProofs(self):
+        '''Count the proofs without building them, memoizing numbers 
+        in `counts`, and keep the number in `count`. Left rules are 
+        counted in focused form (see `_countFocus`), where every proof
+        has one derivation. `countMethod` is set to 'tabulated'.'''
+        self.countMethod = 'tabulated'
+        self.counts.clear()
+        con, pres = self.prepare()
+        self.count = self._count((con, *pres)) if self.balanced(con, pres) else 0
+        return self.count
+
+
+    def _count(self, goal):
+        key = self.memoKey(goal)
+        res = self.counts.get(key)
+        if res is Missing:
+            start = perf_counter()
+            res = next(filter(None, self.countPhases(goal[0], goal[1:])), 0)
+            self.counts.put(key, res, perf_counter() - start)
+        return res
+
+
+    def countPhases(self, con, pres):
+        '''Yield the number of proofs of every phase of `rules`.'''
+        if not con.isAtom:
+            yield self.countAlts(self.rightRules(con, pres))
+        else:
+            yield self.countLeft(con, pres)
+
+
+    def countAlts(self, alts):
+        '''The number of proofs of alternatives `(links, subgoals)`.'''
+        total = 0
+        for _, subgoals in alts:
+            n = 1
+            for sub in subgoals:
+                n *= self._count(sub)
+                if not n: break
+            total += n
+        return total
+
+
+    def countLeft(self, con, pres, focus=None):
+        '''The number of proofs of `pres -> con` by left rules, summed over 
+        the premise taken apart first (any of the positions `focus`).'''
+        if len(pres) == 1 and pres[0].isAtom:
+            return int(self.isAxiom(con, pres[0]))
+        if focus is None: 
+            focus = range(len(pres))
+        return sum(self._countFocus(con, pres, m) for m in focus)
+
+
+    def isAxiom(self, con, x):
+        return x.symbol == con.symbol
+
+
+    def spine(self, x):
+        '''The arguments `(side, arg)` of `x` from the outermost, and
+        its head, which left rules leave of `x` once they take it apart.'''
+        args = []
+        while not x.isAtom:
+            if x.conn == '/':
+                args.append(('r', x.right))
+                x = x.left
+            elif x.conn == '\\':
+                args.append(('l', x.left))
+                x = x.right
             else:
-                if len(pres) == 1 and atomicIden(pres[0], con):
-                    return {frozenset({tuple(sorted({pres[0], con}))})}
+                break
+        return args, x
+
+
+    def argSplits(self, side, arg, pres, lo, hi):
+        '''Yield the ways `arg` on `side` of `pres[lo:hi]` takes premises 
+        next to it, as the subgoal and the new bounds `lo, hi`.'''
+        if side == 'r':
+            for j in range(hi, len(pres) + 1):
+                yield (arg, *pres[hi:j]), lo, j
+        elif side == 'l':
+            for i in range(lo, -1, -1):
+                yield (arg, *pres[i:lo]), i, hi
+
+
+    def _countFocus(self, con, pres, m):
+        '''The number of proofs of `pres -> con` in focused form taking 
+        `pres[m]` apart first: each argument of its `spine` is proved from
+        premises next to what is left of it, until only its head is left,
+        and `pres -> con` is then proved by `head -> con`.'''
+        args, head = self.spine(pres[m])
+        if not args or con.isAtom and head.isAtom and not self.isAxiom(con, head):
+            return 0
+
+        table = {}
+        def count(a, lo, hi):
+            if (a, lo, hi) not in table:
+                if a == len(args):
+                    n = self._count((con, head)) if (lo, hi) == (0, len(pres)) else 0
                 else:
-                    return set()
+                    n = 0
+                    for sub, lo1, hi1 in self.argSplits(*args[a], pres, lo, hi):
+                        if self.balanced(sub[0], sub[1:]):
+                            k = self._count(sub)
+                            if k: n += k * count(a + 1, lo1, hi1)
+                table[a, lo, hi] = n
+            return table[a, lo, hi]
+
+        return count(0, m, m + 1)
 
 
     @property
     def proofCount(self):
         return len(self.proofs)
 
+    @property
+    def storeOptions(self):
+        '''Options that the proofs depend on, see `lib.store`.'''
+        return {k.lstrip('_'): getattr(self, k) for k in self._storeOptions}
+
+    def dumpProofs(self):
+        '''Proofs as sets of pairs of atoms.'''
+        return self.proofs
+
+    def loadProofs(self, proofs):
+        '''Take `proofs` (see `dumpProofs`) instead of parsing.'''
+        self.proofs = set(proofs)
+
+    @property
+    def cacheStats(self):
+        return self.cache.stats
+
 
     def printProofs(self):
         for p in self.proofs:
@@ -0,0 +1,150 @@
+'''Bounded memo tables for proof search.
+
+A cache maps subgoals to their proofs. `get` returns `Missing` for an
+absent key, `put` stores a value with the cost of computing it.
+Both caches below keep hit/miss/eviction counters and the peak number
+of entries, reported by `stats`.
+'''
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+
+Missing = object()
+
+
+class LRUCache:
+    '''Least-recently-used eviction once `maxsize` entries are held.
+    `maxsize=None` means unbounded.'''
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = self.misses = self.evictions = self.peak = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return Missing
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, cost=1):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        self.peak = max(self.peak, len(self._data))
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, peak=self.peak,
+                    size=len(self), maxsize=self.maxsize)
+
+
+class CostCache(LRUCache):
+    '''Cost-aware eviction (GreedyDual): evict the entry whose recomputation
+    cost, aged by the priority of earlier evictions, is the lowest.'''
+    def __init__(self, maxsize=None):
+        LRUCache.__init__(self, maxsize)
+        self._age = 0.
+        self._heap = []
+        self._cost = {}
+        self._prio = {}
+        self._count = itertools.count()
+
+    def _touch(self, key):
+        prio = self._prio[key] = self._age + self._cost[key]
+        heapq.heappush(self._heap, (prio, next(self._count), key))
+        if len(self._heap) > 2 * len(self._prio) + 64:
+            self._heap = [(p, next(self._count), k) 
+                          for k, p in self._prio.items()]
+            heapq.heapify(self._heap)
+
+    def get(self, key):
+        value = LRUCache.get(self, key)
+        if value is not Missing: self._touch(key)
+        return value
+
+    def put(self, key, value, cost=1):
+        self._data[key] = value
+        self._cost[key] = cost
+        self._touch(key)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                prio, _, k = heapq.heappop(self._heap)
+                if self._prio.get(k) == prio:
+                    del self._data[k], self._cost[k], self._prio[k]
+                    self._age = prio
+                    self.evictions += 1
+        self.peak = max(self.peak, len(self._data))
+
+    def clear(self):
+        LRUCache.clear(self)
+        self._heap.clear()
+        self._cost.clear()
+        self._prio.clear()
+        self._age = 0.
+
+
+class LockedCache:
+    '''A cache shared between threads: every call on the wrapped `cache`
+    holds a lock. A pickled copy, e.g. in a worker process, starts empty.'''
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        return LockedCache, (type(self.cache)(self.cache.maxsize),)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.cache)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.cache
+
+    def get(self, key):
+        with self._lock:
+            return self.cache.get(key)
+
+    def put(self, key, value, cost=1):
+        with self._lock:
+            self.cache.put(key, value, cost)
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return self.cache.stats
+
+
+CACHE_POLICIES = dict(lru=LRUCache, cost=CostCache)
+
+
+def makeCache(cache=None, cacheSize=None, cachePolicy='lru'):
+    '''Return `cache` if given, otherwise a new cache of `cachePolicy`
+    bounded by `cacheSize` entries.'''
+    if cache is not None:
+        return cache
+    return CACHE_POLICIES[cachePolicy](cacheSize)
@@ -1,6 +1,8 @@
 '''Utilities for handling category terms.
 '''
 import re
+import weakref
+import threading
 
 
 def isatomic(s: str, conn={'/', '\\'}):
@@ -70,65 +72,160 @@ def bipart(s: str, leftPr='(', rightPr=')',
                 return s[i], left, right
 
 
-def towerSplit(x:str, conn={'/', '\\', '^', '!'}):
-    '''Split a tower of `((b^c)!a)` into `(c, a, b)`.'''
-    if isatomic(x, conn=conn):
-        return (x, None, None)
+class Category:
+    '''Immutable parsed category term. Nodes are interned by their text,
+    so equal categories are the same object and compare by identity.
+    `conn` is `None` for atoms; otherwise `left` and `right` are the
+    components of the top-level connective, whose modal specifier
+    (if any) is kept in `mod`. Atoms carry their `symbol` and `index`.
+    `count` packs the polarity count of every atom type (see `atomCount`).
+    `shape` is the text without atom indices, and `atoms` are the atoms
+    from left to right.
+    '''
+    __slots__ = ['text', 'conn', 'mod', 'left', 'right', 
+                 'isAtom', 'symbol', 'index', 'count', 
+                 'shape', 'atoms', '__weakref__']
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Category is immutable')
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return self.text
+
+    def __reduce__(self):
+        return parseCat, (self.text,)
+
+
+CatConns = {'/', '\\', '^', '!'}
+CatConnModes = {'$', '&'}
+_catPool = weakref.WeakValueDictionary()
+_atomTypes = {'-': None}
+_atomTypesLock = threading.Lock()
+
+
+def atomCount(symbol, base=1 << 32):
+    '''Polarity count vector of a positive atom of type `symbol`,
+    packed into one integer with a `base`-wide digit per atom type. 
+    Packed vectors add up like the vectors, so a sequent can only be
+    derivable if the counts of its premises sum to that of its conclusion
+    (van Benthem). The gap `-` counts nothing.'''
+    if symbol not in _atomTypes:
+        with _atomTypesLock:
+            _atomTypes.setdefault(symbol, len(_atomTypes))
+    n = _atomTypes[symbol]
+    return 0 if n is None else base ** n
+
+
+def _newCat(text, conn=None, mod='', left=None, right=None,
+            pattern=re.compile(r'(?:~*)([-a-zA-Z]+)_?(\d*)'),
+            indexPattern=re.compile(r'_\d+(?!\w)')):
+    if conn is None:
+        m = pattern.search(text)
+        symbol, index = m.groups() if m else (text, '')
+        count = atomCount(symbol)
     else:
-        sep, l, a = bipart(x, conn=conn, noComma=True)
-        if sep != '!' or isatomic(l, conn=conn):
-            return (x, None, None)
+        symbol = index = None
+        if conn in {'/', '^'}:
+            count = left.count - right.count
         else:
-            sep, b, c = bipart(l, conn=conn, noComma=True)
-            if sep != '^':
-                return (x, None, None)
+            count = right.count - left.count
+    shape = indexPattern.sub('', text)
+
+    x = Category()
+    atoms = (x,) if conn is None else left.atoms + right.atoms
+    for name, value in zip(Category.__slots__, (text, conn, mod, left, right, 
+                                                conn is None, symbol, index, count,
+                                                shape, atoms)):
+        object.__setattr__(x, name, value)
+    return _catPool.setdefault(text, x)
+
+
+def parseCat(s: str) -> Category:
+    '''Parse `s` once into an interned `Category`. No top level comma.'''
+    if isinstance(s, Category): return s
+    x = _catPool.get(s)
+    if x is None:
+        text = stripparentheses(s)
+        x = _catPool.get(text)
+        if x is None:
+            if isatomic(text, conn=CatConns):
+                x = _newCat(text)
             else:
-                return (c, a, b)
+                conn, mod, left, right = bipart(text, conn=CatConns, 
+                    connMod=CatConnModes, noComma=True, withMod=True)
+                x = _newCat(text, conn, mod, parseCat(left), parseCat(right))
+        if text != s: _catPool.setdefault(s, x)
+    return x
+
 
+def catAtoms(x:Category):
+    '''Yield the atoms of `x` from left to right.'''
+    yield from x.atoms
 
-def addHypo(x, slash, hypo, fwd={'/', '^'}, 
-                            bkd={'\\', '!'}):   
+
+def towerSplit(x:Category):
+    '''Split a tower of `((b^c)!a)` into `(c, a, b)`.'''
+    if x.conn != '!' or x.left.conn != '^':
+        return (x, None, None)
+    else:
+        return (x.left.right, x.right, x.left.left)
+
+
+def addHypo(x:Category, slash, hypo:Category, 
+            fwd={'/', '^'}, bkd={'\\', '!'}) -> Category:   
     if slash is None: return x
 
-    x = x if isatomic(x, fwd | bkd) else '(%s)' % x
-    hypo = hypo if isatomic(hypo, fwd | bkd) else '(%s)' % hypo
+    xs = x.text if x.isAtom else '(%s)' % x.text
+    hs = hypo.text if hypo.isAtom else '(%s)' % hypo.text
 
     if slash in fwd:
-        return '%s%s%s' % (x, slash, hypo)
+        text, left, right = '%s%s%s' % (xs, slash, hs), x, hypo
     elif slash in bkd:
-        return '%s%s%s' % (hypo, slash, x)
+        text, left, right = '%s%s%s' % (hs, slash, xs), hypo, x
+    
+    return _catPool.get(text) or _newCat(text, slash, '', left, right)
+
+
+def renameAtoms(x:Category, names:dict) -> Category:
+    '''`x` with every atom `a` replaced by the category `names[a.text]`.'''
+    if x.isAtom: return names[x.text]
+
+    left, right = renameAtoms(x.left, names), renameAtoms(x.right, names)
+    ls = left.text if left.isAtom else '(%s)' % left.text
+    rs = right.text if right.isAtom else '(%s)' % right.text
+    text = ls + x.conn + x.mod + rs
+    return _catPool.get(text) or _newCat(text, x.conn, x.mod, left, right)
 
 
-def unslash(x:str, conn={'/', '\\', '^', '!'}) -> [('root', 'slash', 'div')]:
-    '''No commas in `x`. Recognize only `/` and `\\`.'''
+def unslash(x:Category) -> [('root', 'slash', 'div')]:
+    '''Recognize only `/` and `\\`.'''
     xlist = [(x, None, None)]
 
-    while not isatomic(xlist[-1][0], conn=conn):
-        xslash, xleft, xright = bipart(xlist[-1][0], conn=conn, noComma=True)
-        if xslash == '/':
-            xlist.append((xleft, '/', xright))
-        elif xslash == '\\':
-            xlist.append((xright, '\\', xleft))
+    while True:
+        x = xlist[-1][0]
+        if x.conn == '/':
+            xlist.append((x.left, '/', x.right))
+        elif x.conn == '\\':
+            xlist.append((x.right, '\\', x.left))
         else:
             break
 
     return xlist
 
 
-def catIden(x:str, y:str, conn={'/', '\\', '^', '!'}) -> (bool, frozenset):
-    '''No commas in `x` and `y`.'''
-    atomCount = int(isatomic(x, conn=conn)) + int(isatomic(y, conn=conn))    
-    if atomCount == 2:
-        return atomicIden(x, y), frozenset({tuple(sorted({x, y}))}) 
+def catIden(x:Category, y:Category) -> (bool, frozenset):
+    '''Check if `x` equals `y` (up to indexation) and pair up their atoms.'''
+    if x.isAtom and y.isAtom:
+        return (x.symbol == y.symbol, 
+                frozenset({tuple(sorted({x.text, y.text}))}))
          
-    elif atomCount == 0:
-        xslash, xleft, xright = bipart(x, conn=conn, noComma=True)
-        yslash, yleft, yright = bipart(y, conn=conn, noComma=True)
-        
-        if xslash == yslash:
-            leftIden, leftPairs = catIden(xleft, yleft)
-            rightIden, rightPairs = catIden(xright, yright)
-            return leftIden and rightIden, leftPairs | rightPairs
+    elif not (x.isAtom or y.isAtom) and x.conn == y.conn:
+        leftIden, leftPairs = catIden(x.left, y.left)
+        rightIden, rightPairs = catIden(x.right, y.right)
+        return leftIden and rightIden, leftPairs | rightPairs
 
     return False, frozenset()
 
@@ -0,0 +1,53 @@
+'''Lowest common ancestors in a tree in constant time.
+'''
+from array import array
+
+
+class EulerLCA:
+    '''Preprocess a tree, given by the `parent` of every non-root node,
+    for `O(1)` lowest-common-ancestor queries. The Euler tour of the tree
+    is kept with the depths of its nodes, and a sparse table holds the
+    shallowest position in every tour interval of length `2 ** k`.
+    Nodes are non-negative integers.'''
+    def __init__(self, root, parent):
+        children = {}
+        for x, p in parent.items():
+            children.setdefault(p, []).append(x)
+
+        self.euler = array('l')
+        self.depth = array('l')
+        self.first = {}
+        stack = [(root, 0, iter(children.get(root, ())))]
+        self.__visit(root, 0)
+        while stack:
+            x, d, it = stack[-1]
+            y = next(it, None)
+            if y is None:
+                stack.pop()
+                if stack: self.__visit(stack[-1][0], stack[-1][1])
+            else:
+                self.__visit(y, d + 1)
+                stack.append((y, d + 1, iter(children.get(y, ()))))
+
+        depth = self.depth
+        self.table = [array('l', range(len(depth)))]
+        k = 1
+        while 2 * k <= len(depth):
+            prev = self.table[-1]
+            row = array('l', (prev[i] if depth[prev[i]] <= depth[prev[i + k]]
+                              else prev[i + k]
+                              for i in range(len(depth) - 2 * k + 1)))
+            self.table.append(row)
+            k *= 2
+
+    def __visit(self, x, d):
+        self.first.setdefault(x, len(self.euler))
+        self.euler.append(x)
+        self.depth.append(d)
+
+    def __call__(self, x, y):
+        i, j = self.first[x], self.first[y]
+        if i > j: i, j = j, i
+        k = (j - i + 1).bit_length() - 1
+        a, b = self.table[k][i], self.table[k][j - (1 << k) + 1]
+        return self.euler[a if self.depth[a] <= self.depth[b] else b]
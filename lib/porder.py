@@ -1,5 +1,7 @@
 '''Utilities for partial order objects.
 '''
+from sys import getsizeof
+
 
 class CyclicOrderError(Exception): pass
 
@@ -9,6 +11,10 @@ class PartialOrder:
         self.edges = edges.copy()
 
 
+    def copy(self):
+        return PartialOrder(self.nodes, self.edges)
+
+
     def restrict(self, nodes):
         self.nodes &= nodes
         self.edges = {(x, y) for x, y in self.edges if x in nodes and y in nodes}
@@ -31,6 +37,28 @@ class PartialOrder:
                 self.addEdge(u, v)
 
 
+    def extend(self, edges):
+        '''Return a new order with `edges` added. `self` is unchanged.'''
+        po = self.copy()
+        po.addEdgesFrom(edges)
+        return po
+
+
+    def join(self, other):
+        '''`extend` by the edges of `other`.'''
+        return self.extend(other - self)
+
+
+    def dump(self):
+        '''A compact picklable form of the edges, see `load`.'''
+        return tuple(self.edges)
+
+
+    def load(self, data):
+        '''Return the order on the nodes of `self` with the edges `data`.'''
+        return PartialOrder(self.nodes, set(data))
+
+
     def isAcyclic(self):
         return not any((n, n) in self.edges for n in self.nodes)
 
@@ -75,6 +103,12 @@ class PartialOrder:
         return len(self.edges)
 
 
+    def nbytes(self):
+        '''Approximate memory held by the order.'''
+        return (getsizeof(self) + getsizeof(self.nodes) + getsizeof(self.edges)
+                + sum(map(getsizeof, self.edges)))
+
+
     def __contains__(self, e):
         return e in self.edges
 
@@ -89,3 +123,228 @@ class PartialOrder:
     
     def __repr__(self):
         return str(self.edges)
+
+
+class BitPartialOrder:
+    '''`PartialOrder` kept as reachability bitmasks: bit `j` of `succ[i]`
+    is set iff node `i` precedes node `j`. Nodes are numbered once by
+    `index`, which copies share. Adding an edge updates the closure with
+    one `or` per affected row, and a cycle is a single bit test.'''
+    __slots__ = ['index', 'order', 'mask', 'succ']
+
+    def __init__(self, nodes, edges, index=None):
+        if index is None:
+            order = sorted(nodes, key=repr)
+            index = {x: i for i, x in enumerate(order)}
+        self.index = index
+        self.order = list(index)
+        self.mask = 0
+        for x in nodes: self.mask |= 1 << index[x]
+        self.succ = [0] * len(index)
+        for x, y in edges:
+            self.succ[index[x]] |= 1 << index[y]
+
+
+    def copy(self):
+        po = BitPartialOrder.__new__(BitPartialOrder)
+        po.index, po.order, po.mask = self.index, self.order, self.mask
+        po.succ = self.succ.copy()
+        return po
+
+
+    @property
+    def nodes(self):
+        return {x for i, x in enumerate(self.order) if self.mask >> i & 1}
+
+
+    @property
+    def edges(self):
+        return {(self.order[i], self.order[j]) 
+                for i in range(len(self.order)) for j in bits(self.succ[i])}
+
+
+    def restrict(self, nodes):
+        keep = 0
+        for x in nodes:
+            if x in self.index: keep |= 1 << self.index[x]
+        self.mask &= keep
+        for i in range(len(self.order)):
+            if self.mask >> i & 1:
+                self.succ[i] &= self.mask
+            else:
+                self.succ[i] = 0
+
+
+    def addEdge(self, u, v):
+        assert {u, v} <= self.nodes
+        self._addEdge(self.index[u], self.index[v])
+
+
+    def _addEdge(self, i, j):
+        succ = self.succ
+        if not succ[i] >> j & 1:
+            after = succ[j] | 1 << j
+            for x, row in enumerate(succ):
+                if row >> i & 1 or x == i:
+                    succ[x] = row | after
+
+
+    def addEdgesFrom(self, edges):
+        for u, v in edges:
+            i, j = self.index[u], self.index[v]
+            if self.succ[j] >> i & 1:
+                raise CyclicOrderError
+            else:
+                self._addEdge(i, j)
+
+
+    def extend(self, edges):
+        '''Return the order with `edges` added, which is `self` itself if 
+        no edge is new. `self` is unchanged, and its rows are copied only 
+        once an edge is found new; an edge that closes a cycle with the
+        rows of `self` raises `CyclicOrderError` before any copy.
+        Orders that are only extended can thus share objects.'''
+        index, succ = self.index, self.succ
+        new = []
+        for u, v in edges:
+            i, j = index[u], index[v]
+            if succ[j] >> i & 1:
+                raise CyclicOrderError
+            if not succ[i] >> j & 1:
+                new.append((i, j))
+        if not new:
+            return self
+
+        po = self.copy()
+        for i, j in new:
+            if po.succ[j] >> i & 1:
+                raise CyclicOrderError
+            po._addEdge(i, j)
+        return po
+
+
+    def project(self, keep):
+        '''Return the order between the nodes in the bitmask `keep` only:
+        the relations of other nodes are forgotten, which is `self` itself
+        if they have none.'''
+        succ = [row & keep if keep >> i & 1 else 0 
+                for i, row in enumerate(self.succ)]
+        if succ == self.succ:
+            return self
+        po = BitPartialOrder.__new__(BitPartialOrder)
+        po.index, po.order, po.mask = self.index, self.order, self.mask
+        po.succ = succ
+        return po
+
+
+    def join(self, other):
+        '''`extend` by the edges of `other`, numbered by the same `index`.
+        The union of rows is closed by composing it with itself.'''
+        succ = [a | b for a, b in zip(self.succ, other.succ)]
+        if succ == self.succ:
+            return self
+
+        changed = True
+        while changed:
+            changed = False
+            for i, row in enumerate(succ):
+                closed = row
+                for j in bits(row): closed |= succ[j]
+                if closed != row:
+                    if closed >> i & 1: raise CyclicOrderError
+                    succ[i] = closed
+                    changed = True
+
+        po = BitPartialOrder.__new__(BitPartialOrder)
+        po.index, po.order, po.mask = self.index, self.order, self.mask
+        po.succ = succ
+        return po
+
+
+    def dump(self):
+        '''The rows only, as a tuple of ints: the `index` is left out,
+        which the orders `load`ed from them share with `self`.'''
+        return tuple(self.succ)
+
+
+    def load(self, data):
+        '''Return the order with the rows `data`, numbered by the `index` 
+        of `self`.'''
+        po = BitPartialOrder.__new__(BitPartialOrder)
+        po.index, po.order, po.mask = self.index, self.order, self.mask
+        po.succ = list(data)
+        return po
+
+
+    def isAcyclic(self):
+        return not any(self.succ[i] >> i & 1 for i in range(len(self.order)))
+
+
+    @classmethod
+    def fromPairs(cls, pairs):
+        nodes = {x for x, y in pairs} | {y for x, y in pairs}
+        po = cls(nodes, ())
+        for x, y in pairs:
+            po._addEdge(po.index[x], po.index[y])
+        return po
+
+
+    seqToPairs = staticmethod(PartialOrder.seqToPairs)
+
+
+    def __or__(self, other):
+        if other.index is not self.index:
+            po = BitPartialOrder(self.nodes | other.nodes, ())
+            for x, y in self.edges | other.edges:
+                po._addEdge(po.index[x], po.index[y])
+            return po
+        po = self.copy()
+        po.mask |= other.mask
+        for i in range(len(self.order)):
+            for j in bits(other.succ[i]):
+                po._addEdge(i, j)
+        return po
+
+
+    def __sub__(self, other):
+        return {(self.order[i], self.order[j]) 
+                for i in range(len(self.order)) 
+                for j in bits(self.succ[i] & ~other.succ[i])}
+
+
+    def __len__(self):
+        return sum(bin(x).count('1') for x in self.succ)
+
+
+    def nbytes(self):
+        '''Approximate memory held by the order, except the shared `index`.'''
+        return getsizeof(self) + getsizeof(self.succ) + sum(map(getsizeof, self.succ))
+
+
+    def __contains__(self, e):
+        x, y = e
+        return (x in self.index and y in self.index
+                and bool(self.succ[self.index[x]] >> self.index[y] & 1))
+
+
+    def __eq__(self, other):
+        return self.succ == other.succ
+
+
+    def __hash__(self):
+        return hash(tuple(self.succ))
+
+
+    def __repr__(self):
+        return str(self.edges)
+
+
+def bits(x):
+    '''Yield the positions of the set bits of `x`.'''
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+
+PORDER_BACKENDS = dict(sets=PartialOrder, bits=BitPartialOrder)
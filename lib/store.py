@@ -0,0 +1,85 @@
+'''Persistent proof store shared across runs.
+
+Proofs are kept in a SQLite file, keyed by the calculus, its options
+and the sequent with atom indices removed. An atom link is recorded
+as the pair of the atoms' positions in the sequent (counted from left
+to right, the conclusion first), so stored proofs do not depend on the
+indices given by `cindex.indexSeq` and are re-indexed on load.
+'''
+import re
+import json
+import sqlite3
+
+from .cterm import parseCat, catAtoms
+from .cindex import StopAtoms
+
+
+def unindex(s, pattern=re.compile(r'_\d+(?!\w)')):
+    '''Remove the atom indices added by `cindex.addIndex`.'''
+    return pattern.sub('', parseCat(s).text)
+
+
+def atomTexts(con, pres):
+    '''Atoms of an indexed sequent from left to right, gaps excluded.'''
+    return [x.text for s in [con] + list(pres)
+                   for x in catAtoms(parseCat(s))
+                   if x.text not in StopAtoms]
+
+
+class ProofStore:
+    '''`get` returns the stored proofs of an indexed sequent,
+    or `None` if the sequent has not been proved yet.
+    `put` records the proofs found by a parser.'''
+    def __init__(self, path):
+        self.path = path
+        self.hits = self.misses = 0
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS proofs ('
+                         'calc TEXT, options TEXT, sequent TEXT, links TEXT, '
+                         'PRIMARY KEY (calc, options, sequent))')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM proofs').fetchone()[0]
+
+    @staticmethod
+    def key(calc, options, con, pres):
+        return (calc.__name__,
+                json.dumps(options, sort_keys=True),
+                ' '.join(unindex(s) for s in [con] + list(pres)))
+
+    def get(self, calc, options, con, pres):
+        '''Return a list of proofs as sets of pairs of atoms of `con`, `pres`.'''
+        row = self._db.execute('SELECT links FROM proofs WHERE '
+                               'calc = ? AND options = ? AND sequent = ?',
+                               self.key(calc, options, con, pres)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        atoms = atomTexts(con, pres)
+        return [frozenset(tuple(sorted((atoms[i], atoms[j]))) for i, j in p)
+                for p in json.loads(row[0])]
+
+    def put(self, calc, options, con, pres, proofs):
+        '''Record `proofs` given as sets of pairs of atoms of `con`, `pres`.'''
+        pos = {x: n for n, x in enumerate(atomTexts(con, pres))}
+        links = sorted(sorted(sorted((pos[x], pos[y])) for x, y in p)
+                       for p in proofs)
+        self._db.execute('INSERT OR REPLACE INTO proofs VALUES (?, ?, ?, ?)',
+                         self.key(calc, options, con, pres)
+                         + (json.dumps(links),))
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self))
@@ -10,7 +10,7 @@ def trans_cat(cat, inMath):
             trans_cat(b, True),
             trans_cat(c, True))
     else:
-        return trans_term(cat, inMath)
+        return trans_term(str(cat), inMath)
 
 
 def axiom_line(cat, indent=''):
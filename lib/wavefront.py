@@ -0,0 +1,74 @@
+'''Wavefront-parallel filling of CKY charts.
+
+The cells of a chart on one diagonal (intervals of the same length)
+only read cells of shorter intervals, so they can be filled at once.
+`Wavefront` sends every diagonal over a process pool in chunks of
+neighbouring cells, and hands the filled cells back to the parser to
+merge into its chart before the next diagonal.
+
+A parser taking part provides:
+ - `_cellInputs(i, k)`: the cells that filling `(i, k)` reads;
+ - `_fillCell(span, i, k)`: fill `(i, k)` from the cells in `span`;
+ - `_packCell(cell)` and `_unpackCell(data)`: a compact picklable
+   form of a cell and back.
+The parser is sent to every worker once, when the pool starts.
+'''
+from multiprocessing import Pool
+
+
+_worker = {}
+
+
+def _init(parser):
+    _worker['parser'] = parser
+
+
+def _fill(task):
+    parser = _worker['parser']
+    cells, inputs = task
+    span = {ik: parser._unpackCell(data) for ik, data in inputs}
+    return [(ik, parser._packCell(parser._fillCell(span, *ik)))
+            for ik in cells]
+
+
+class Wavefront:
+    '''A pool of `workers` processes filling the chart of `parser`.
+    A cell is packed once, when it is first sent to a worker.'''
+    def __init__(self, parser, workers):
+        self.parser = parser
+        self.workers = workers
+        self._packed = {}
+        self._pool = Pool(workers, _init, (parser,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._pool.terminate()
+
+    def __pack(self, span, ik):
+        if ik not in self._packed:
+            self._packed[ik] = self.parser._packCell(span[ik])
+        return self._packed[ik]
+
+    def drop(self, ik):
+        '''Forget the packed cell `ik`, once no longer read.'''
+        self._packed.pop(ik, None)
+
+    def fill(self, span, cells):
+        '''Fill `cells` of one diagonal from the cells in `span`.
+        Yield `(i, k), cell` for each of them, in the order of `cells`.'''
+        size = -(-len(cells) // (2 * self.workers))
+        tasks = []
+        for n in range(0, len(cells), size):
+            chunk = cells[n:n + size]
+            inputs = {x for ik in chunk for x in self.parser._cellInputs(*ik)}
+            tasks.append((chunk, [(x, self.__pack(span, x)) for x in inputs]))
+
+        for res in self._pool.imap(_fill, tasks):
+            for ik, data in res:
+                self._packed[ik] = data
+                yield ik, self.parser._unpackCell(data)
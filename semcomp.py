@@ -104,8 +104,8 @@ class SemComp:
         cls.vocab = json.load(open(vocab_path))
 
 
-    def unify(self, con:str='s', **kwargs):
-        '''Unification.'''
+    def unify(self, con:str='s', limit=None, **kwargs):
+        '''Unification. Keep only the first `limit` readings if given.'''
         self.semantics = []
         self.syntax = []
 
@@ -118,6 +118,10 @@ class SemComp:
         sorts = [g.sort for g in self.tokens]
 
         for con, pres in al.deAbbr(con, pres, self.abbr, self.calc):
+            if limit is not None:
+                if len(self.semantics) >= limit: break
+                if issubclass(self.calc, al.LambekProof):
+                    kwargs['limit'] = limit - len(self.semantics)
             con, pres, parse, idxDic = al.searchLinks(self.calc, con, pres, **kwargs)
 
             if parse.proofs:
@@ -128,6 +132,7 @@ class SemComp:
                         sorts[i] = _tokens[i].sort
 
             for p in parse.proofs:
+                if limit is not None and len(self.semantics) >= limit: break
                 qset = quotSet(p, idxDic, self.xref, sorts)
                 Gs = []
                 for g in _tokens: